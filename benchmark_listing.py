@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+Compare memory and parse time of full TSC items and compact ResourceRecord
+objects for a large listing. Runs offline on a generated views response.
+
+    ./benchmark_listing.py --count 100000
+"""
+
+import tableau_wrapper as TW
+import tableauserverclient as TSC
+import argparse
+import gc
+import time
+import tracemalloc
+
+
+VIEW = ('<view id="{0:08d}-0000-0000-0000-000000000000" name="View {0}" '
+        'contentUrl="Workbook{0}/sheets/View{0}" '
+        'createdAt="2020-01-01T00:00:00Z" updatedAt="2020-06-01T00:00:00Z">'
+        '<workbook id="{0:08d}-1111-0000-0000-000000000000" />'
+        '<owner id="{0:08d}-2222-0000-0000-000000000000" />'
+        '<project id="{0:08d}-3333-0000-0000-000000000000" />'
+        '<tags />'
+        '</view>')
+
+
+def make_response(count):
+    """
+    Generate the XML of a views listing with count views
+    """
+
+    views = "".join(VIEW.format(number) for number in range(count))
+    return (('<?xml version="1.0" encoding="UTF-8"?>'
+             '<tsResponse xmlns="http://tableau.com/api">'
+             '<pagination pageNumber="1" pageSize="{0}" '
+             'totalAvailable="{0}" />'
+             '<views>{1}</views></tsResponse>').format(count, views)
+            .encode("utf-8"))
+
+
+def measure(parse, content):
+    """
+    Parse content and return the seconds it took and the peak and retained
+    memory in bytes
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = parse(content)
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return (elapsed, peak, retained)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--count", type=int, default=100000,
+                        help="number of views in the listing")
+    args = parser.parse_args()
+    content = make_response(args.count)
+    namespace = {"t": "http://tableau.com/api"}
+    candidates = (
+        ("TSC.ViewItem", lambda data: TSC.ViewItem.from_response(data,
+                                                                 namespace)),
+        ("ResourceRecord", lambda data: TW._parse_records("view", data)[0]),
+    )
+    print("{} views, {:.1f} MB response".format(args.count,
+                                                len(content) / 1e6))
+    for name, parse in candidates:
+        elapsed, peak, retained = measure(parse, content)
+        print("{:<16} {:7.2f} s  peak {:8.1f} MB  retained {:8.1f} MB".format(
+            name, elapsed, peak / 1e6, retained / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,32 +2,121 @@
 
 import pick
 import tableau_wrapper as TW
+import tableau_daemon as TD
+import atexit
 import click
+import threading
 #import tableauserverclient as TSC
 from tableauserverclient import ServerResponseError
 
 
-def pick_object(all_resources, resource_type):
+class Listing(object):
     """
-    CLI - waits for the user to pick one of the resources
+    CLI - listing of one resource type fetched on a background thread, the
+    records get appended page by page as they arrive
+    """
+
+    def __init__(self, resource_type):
+        self.resource_type = resource_type
+        self.records = []
+        self.lock = threading.Lock()
+        self.arrived = threading.Condition(self.lock)
+        self.done = False
+        self.error = None
+        self.cancelled = threading.Event()
+
+    def fetch(self, wrapper, server):
+        try:
+            # the daemon sends the whole (cached) listing at once
+            if server is None:
+                pages = [wrapper.get_resource_records(self.resource_type, server)]
+            else:
+                pages = wrapper.iter_resource_pages(self.resource_type, server)
+            for records in pages:
+                if self.cancelled.is_set():
+                    return
+                with self.lock:
+                    self.records.extend(records)
+                    self.arrived.notify_all()
+        except Exception as err:
+            self.error = err
+        finally:
+            with self.lock:
+                self.done = True
+                self.arrived.notify_all()
+
+    def snapshot(self, timeout=None):
+        """
+        Wait until there is at least one record (or the listing is done) and
+        return the records so far and if the listing is complete
+        """
+
+        with self.lock:
+            self.arrived.wait_for(lambda: self.records or self.done, timeout)
+            if self.error is not None:
+                raise self.error
+            return (list(self.records), self.done)
+
+
+# listings still fetching, cancelled when the process exits
+running_listings = []
+
+
+@atexit.register
+def cancel_listings():
+    for listing in running_listings:
+        listing.cancelled.set()
+
+
+def prefetch_listings(wrapper, server, resource_types):
+    """
+    CLI - start fetching the listings of resource_types on background
+    threads right after sign-in, while the user is still choosing
 
     Parameters:
-    all_resources   -- list of all resources as objects
-    resource_type   -- type of the resources
-                       'workbook'/'view'/'datasource'/'project'
+    wrapper         -- wrapper returned by authenticate_cli
+    server          -- server returned by authenticate_cli
+    resource_types  -- list of 'workbook'/'view'/'datasource'/'project'
+
+    Return value(s):
+    listings        -- dict resource_type -> Listing
+    """
+
+    listings = {}
+    for resource_type in resource_types:
+        listing = Listing(resource_type)
+        running_listings.append(listing)
+        threading.Thread(target=listing.fetch, args=(wrapper, server), daemon=True).start()
+        listings[resource_type] = listing
+    return (listings)
+
+
+def pick_streamed(listing):
+    """
+    CLI - lets the user pick one of the resources of a listing while it is
+    still arriving, the resources that arrived so far get shown together
+    with an entry to reload the list with the ones that arrived since
 
     Return value(s):
     resource        -- selected resource object
     resource_id     -- id of selected resource
     resource_name   -- name of selected resource
-
-    Exception(s):
-    NameError       -- invalid resource_type
     """
 
-    all_resources_name = [single_object.name for single_object in all_resources]
-    option, index = pick.pick(all_resources_name, title="Choose a {}:".format(resource_type), indicator='->')
-    return (all_resources[index], all_resources[index].id, all_resources[index].name)
+    while True:
+        records, done = listing.snapshot()
+        if done and not records:
+            print("There is no {} on the server".format(listing.resource_type))
+            exit()
+        names = [record.name for record in records]
+        if not done:
+            names.append("... still loading ({} so far), choose to show more".format(len(records)))
+        option, index = pick.pick(names, title="Choose a {}:".format(listing.resource_type), indicator='->')
+        if index < len(records):
+            return (records[index], records[index].id, records[index].name)
+        # give the listing a moment to bring in more records
+        with listing.lock:
+            listing.arrived.wait(timeout=1)
 
 
 @click.group()
@@ -44,7 +133,10 @@ def cli():
 @click.option('-n', '--object_name', help='The name of the resource')
 @click.option('-pr', '--project_name', help='The name of the project')
 def download_cli(object_type, object_name, username, password, server_url, project_name):
-    server = authenticate_cli(username, password, server_url)
+    wrapper, server = authenticate_cli(username, password, server_url)
+    # start fetching the listings while the user is still choosing
+    if object_name is None:
+        listings = prefetch_listings(wrapper, server, [object_type] if object_type else ['workbook', 'view', 'datasource'])
     # if user didn't specify what type of object they want to
     # download they'll get prompted to choose from a list
     if object_type is None:
@@ -52,24 +144,22 @@ def download_cli(object_type, object_name, username, password, server_url, proje
                                         title='What do you want to download?',
                                         indicator='->')
     if object_name is None:
-        # get list of all the objects on the server of chosen type
-        all_objects = TW.get_resource_list(object_type, server)
-        # let user select one of the objects
-        selected_object, object_id, object_name = pick_object(all_objects, object_type)
+        # let user select one of the objects of chosen type
+        selected_object, object_id, object_name = pick_streamed(listings[object_type])
     else:
-        object_id, selected_object = TW.get_resource_id(object_type, object_name, project_name, server)
+        object_id, selected_object = wrapper.get_resource_id(object_type, object_name, project_name, server)
         object_id = selected_object.id
     if object_type == "workbook" or object_type == "datasource":
         project_name = selected_object.project_name
-        TW.download(resource_type=object_type, resource_name=object_name, project_name=project_name, server=server)
+        wrapper.download(resource_type=object_type, resource_name=object_name, project_name=project_name, server=server)
     elif object_type == "view":
         format, _ = pick.pick(['image', 'pdf', 'csv'], title='In which format would you like to download the view?', indicator='->')
         if format == 'pdf':
-            TW.download_view_pdf(object_name, project_name=None, server=server)
+            wrapper.download_view_pdf(object_name, project_name=None, server=server)
         elif format == 'image':
-            TW.download_view_image(object_name, server=server)
+            wrapper.download_view_image(object_name, server=server)
         elif format == 'csv':
-            TW.download_view_csv(object_name, server=server, project_name=None)
+            wrapper.download_view_csv(object_name, server=server, project_name=None)
 
 
 @cli.command(help='Publish a workbook or datasource to the server')
@@ -82,7 +172,10 @@ def download_cli(object_type, object_name, username, password, server_url, proje
 @click.option('-t', '--object_type', type=click.Choice(['workbook', 'view', 'datasource']))
 @click.option('--publish_path', type=click.Path(exists=True), prompt="Please enter the path of the file you would like to publish")
 def publish_cli(object_type, project_name, publish_path, username, password, server_url, mode):
-    server = authenticate_cli(username, password, server_url)
+    wrapper, server = authenticate_cli(username, password, server_url)
+    # start fetching the projects while the user is still choosing
+    if project_name is None:
+        listings = prefetch_listings(wrapper, server, ['project'])
     # if user hasn't specified yet what the resource_type is let them choose
     # one
     if object_type is None:
@@ -91,16 +184,43 @@ def publish_cli(object_type, project_name, publish_path, username, password, ser
                                         indicator='->')
     # if user hasn't specified a resource_name yet let them pick one
     if project_name is None:
-        # get list of all the objects on the server of chosen type
-        all_objects = TW.get_resource_list("project", server)
-        # let user select one of the objects
-        selected_object, project_id, project_name = pick_object(all_objects,
-                                                                   "project")
+        # let user select one of the projects
+        selected_object, project_id, project_name = pick_streamed(listings['project'])
     # publish resource
-    TW.publish(resource_type=object_type, path=publish_path,
+    wrapper.publish(resource_type=object_type, path=publish_path,
             project_name=project_name, mode=mode, server=server)
 
 
+@cli.command(help='Append the new rows of a local CSV/Parquet file to a datasource')
+@click.option('-u', '--username', prompt=True, help='The username for authentication with the server')
+@click.option('-p', '--password', prompt=True, hide_input=True, help='The password for authentication with the server')
+@click.option('-s', '--server_url', prompt=True, help='The url for the server')
+@click.option('--project_name')
+@click.option('-n', '--datasource_name', prompt=True, help='The name of the datasource to append to')
+@click.option('-w', '--watermark_column', prompt=True, help='The column tracking new rows (timestamp or id)')
+@click.option('--watermark_type', type=click.Choice(['int', 'double', 'date', 'timestamp']),
+              help='The type of the watermark column (inferred from the file by default)')
+@click.option('--columns', help="All the columns with their types, e.g. 'id:int,amount:double,note:text'")
+@click.option('--initial_watermark',
+              help='The highest watermark the datasource already holds (first run only, '
+                   'without it the first run overwrites the datasource)')
+@click.option('--source_path', type=click.Path(exists=True), prompt="Please enter the path of the CSV or Parquet file")
+def publish_incremental_cli(project_name, datasource_name, watermark_column, watermark_type, columns,
+                            initial_watermark, source_path, username, password, server_url):
+    if columns is not None:
+        columns = [tuple(column.split(':', 1)) for column in columns.split(',')]
+    wrapper, server = authenticate_cli(username, password, server_url)
+    # if user hasn't specified a project yet let them pick one
+    if project_name is None:
+        selected_object, project_id, project_name = pick_streamed(prefetch_listings(wrapper, server, ['project'])['project'])
+    resource_id, row_count, skipped_count = wrapper.publish_incremental(
+        datasource_name, project_name, source_path, watermark_column, columns=columns,
+        watermark_type=watermark_type, initial_watermark=initial_watermark, server=server)
+    print("Appended {} new rows to '{}'".format(row_count, datasource_name))
+    if skipped_count:
+        print("Skipped {} rows without a '{}' value".format(skipped_count, watermark_column))
+
+
 @cli.command(help='Refresh a workbook')
 @click.option('-u', '--username', prompt=True, help='The username for authentication with the server')
 @click.option('-p', '--password', prompt=True, hide_input=True, help='The password for authentication with the server')
@@ -110,30 +230,46 @@ def publish_cli(object_type, project_name, publish_path, username, password, ser
 @click.option('-t', '--object_type', type=click.Choice(['workbook', 'view', 'datasource']))
 def refresh_cli(object_name, object_type, username, password, server_url):
     try:
-        server = authenticate_cli(username, password, server_url)
+        wrapper, server = authenticate_cli(username, password, server_url)
+        # start fetching the listings while the user is still choosing
+        if object_name is None:
+            listings = prefetch_listings(wrapper, server, [object_type] if object_type else ['workbook', 'datasource'])
         # if user hasn't specified yet what the resource_type is let them choose one
         if object_type is None:
             object_type, _ = pick.pick(['workbook', 'datasource'],
                                             title='What do you want to refresh?', indicator='->')
         # if user hasn't specified a resource_name yet let them pick one
         if object_name is None:
-            # get list of all the objects on the server of chosen type
-            all_objects = TW.get_resource_list(object_type, server)
-            # let user select one of the objects
-            resource_object, _, object_name = pick_object(all_objects, object_type)
+            # let user select one of the objects of chosen type
+            resource_object, _, object_name = pick_streamed(listings[object_type])
         # refresh the resource
-        TW.refresh(object_type, object_name, resource_object.project_name, server=server)
+        wrapper.refresh(object_type, object_name, resource_object.project_name, server=server)
     except ServerResponseError as err:
         print(err)
 
 
-def authenticate_cli(username, password, server_url):
+def authenticate_cli(username, password, server_url, use_daemon=True):
+    """
+    CLI - signs in, through the daemon if one is running
+
+    Return value(s):
+    wrapper         -- object to call the wrapper functions on, the
+                       tableau_wrapper module or a daemon RemoteWrapper
+    server          -- signed in server, None when going through the daemon
+    """
+
     try:
+        # if a daemon is running hand the operations to its warm sessions
+        daemon_info = TD.daemon_running() if use_daemon else None
+        if daemon_info is not None:
+            wrapper = TD.RemoteWrapper(daemon_info, server_url, username, password)
+            wrapper.sign_in()
+            return (wrapper, None)
         server = TW.authenticate(server_url, username, password)
     except ServerResponseError as err:
         print(err)
         exit()
-    return (server)
+    return (TW, server)
 
 
 @cli.command(help='Create a project')
@@ -144,7 +280,7 @@ def authenticate_cli(username, password, server_url):
 @click.option('--description')
 @click.option('--content_permission')
 def create_cli(project_name, description, content_permission, username, password, server_url):
-    server = authenticate_cli(username, password, server_url)
+    wrapper, server = authenticate_cli(username, password, server_url)
     # refresh the resource
     if project_name is None:
         project_name = input("Please enter a project name:\n")
@@ -152,7 +288,7 @@ def create_cli(project_name, description, content_permission, username, password
         description = input("Please enter a description for the project:\n")
     if content_permissions is None:
         content_permissions, _ = pick.pick(['ManagedByOwner', 'LockedToProject'], title='Please choose a content permission', indicator='->')
-    TW.create(project_name, description, content_permissions, server=server)
+    wrapper.create(project_name, description, content_permissions, server=server)
 
 
 @cli.command(help='Delete workbook, datasource or project')
@@ -164,26 +300,114 @@ def create_cli(project_name, description, content_permission, username, password
 @click.option('-t', '--object_type', type=click.Choice(['workbook', 'view', 'datasource']))
 @click.option('--object_name')
 def delete_cli(object_name, object_type, project_name, username, password, server_url):
-    server = authenticate_cli(username, password, server_url)
+    wrapper, server = authenticate_cli(username, password, server_url)
+    # start fetching the listings while the user is still choosing
+    if object_name is None:
+        listings = prefetch_listings(wrapper, server, [object_type] if object_type else ['workbook', 'datasource', 'project'])
     # if user hasn't specified yet what the resource_type is let them choose one
     if object_type is None:
         object_type, _ = pick.pick(['workbook', 'datasource', 'project'],
                                         title='What do you want to delete?', indicator='->')
     # if user hasn't specified a resource_name yet let them pick one
     if object_name is None:
-        # get list of all the objects on the server of chosen type
-        all_objects = TW.get_resource_list(object_type, server)
-        # let user select one of the objects
-        resource_object, _, object_name = pick_object(all_objects, object_type)
+        # let user select one of the objects of chosen type
+        resource_object, _, object_name = pick_streamed(listings[object_type])
     if object_type == "workbook" or object_type == "datasource":
         project_name = resource_object.project_name
     else:
         project_name = None
     # refresh the resource
-    resource_id = TW.delete(object_type, object_name, project_name, server)
+    resource_id = wrapper.delete(object_type, object_name, project_name, server)
     return (resource_id)
 
 
+def print_plan(plan):
+    """
+    CLI - prints the per-resource plan/results of a bulk operation
+    """
+
+    for entry in plan:
+        target = " -> {}".format(entry["new_name"]) if entry["new_name"] else ""
+        error = " ({})".format(entry["error"]) if entry["error"] else ""
+        print("[{}] {} {} '{}'{}{}".format(entry["status"], entry["action"], entry["resource_type"],
+                                          entry["name"], target, error))
+    print("{} {}(s)".format(len(plan), plan[0]["resource_type"] if plan else "resource"))
+
+
+@cli.command(help='Delete all workbooks, datasources or projects matching the filters')
+@click.option('-u', '--username', prompt=True, help='The username for authentication with the server')
+@click.option('-p', '--password', prompt=True, hide_input=True, help='The password for authentication with the server')
+@click.option('-s', '--server_url', prompt=True, help='The url for the server')
+@click.option('-t', '--object_type', type=click.Choice(['workbook', 'datasource', 'project']), prompt=True)
+@click.option('--project_name', help='Only resources in this project')
+@click.option('--name_pattern', help="Only resources matching this pattern, e.g. 'tmp_*'")
+@click.option('--owner_name', help='Only resources owned by this user')
+@click.option('--older_than_days', type=int, help='Only resources not updated in this many days')
+@click.option('--dry_run', is_flag=True, help='Only show the plan')
+@click.option('--workers', default=8, help='Number of parallel deletes')
+def bulk_delete_cli(object_type, project_name, name_pattern, owner_name, older_than_days, dry_run, workers,
+                    username, password, server_url):
+    wrapper, server = authenticate_cli(username, password, server_url)
+    filters = dict(project_name=project_name, name_pattern=name_pattern, owner_name=owner_name,
+                   older_than_days=older_than_days, max_workers=workers, server=server)
+    # always show the plan first
+    plan = wrapper.bulk_delete(object_type, dry_run=True, **filters)
+    print_plan(plan)
+    if dry_run or not plan or not click.confirm("Delete these {} resources?".format(len(plan))):
+        return
+    # run exactly the confirmed plan
+    print_plan(wrapper.execute_bulk_plan(plan, max_workers=workers, server=server))
+
+
+@cli.command(help='Rename all workbooks, datasources or projects matching the filters')
+@click.option('-u', '--username', prompt=True, help='The username for authentication with the server')
+@click.option('-p', '--password', prompt=True, hide_input=True, help='The password for authentication with the server')
+@click.option('-s', '--server_url', prompt=True, help='The url for the server')
+@click.option('-t', '--object_type', type=click.Choice(['workbook', 'datasource', 'project']), prompt=True)
+@click.option('-n', '--new_name', prompt=True, help="The new name, {name} is the current name, e.g. '{name} (old)'")
+@click.option('--project_name', help='Only resources in this project')
+@click.option('--name_pattern', help="Only resources matching this pattern, e.g. 'tmp_*'")
+@click.option('--owner_name', help='Only resources owned by this user')
+@click.option('--older_than_days', type=int, help='Only resources not updated in this many days')
+@click.option('--dry_run', is_flag=True, help='Only show the plan')
+@click.option('--workers', default=8, help='Number of parallel updates')
+def bulk_rename_cli(object_type, new_name, project_name, name_pattern, owner_name, older_than_days, dry_run,
+                    workers, username, password, server_url):
+    wrapper, server = authenticate_cli(username, password, server_url)
+    filters = dict(project_name=project_name, name_pattern=name_pattern, owner_name=owner_name,
+                   older_than_days=older_than_days, max_workers=workers, server=server)
+    # always show the plan first
+    plan = wrapper.bulk_rename(object_type, new_name, dry_run=True, **filters)
+    print_plan(plan)
+    if dry_run or not plan or not click.confirm("Rename these {} resources?".format(len(plan))):
+        return
+    # run exactly the confirmed plan
+    print_plan(wrapper.execute_bulk_plan(plan, max_workers=workers, server=server))
+
+
+@cli.command(help='Download or delete a project with all its sub-projects and contents')
+@click.option('-u', '--username', prompt=True, help='The username for authentication with the server')
+@click.option('-p', '--password', prompt=True, hide_input=True, help='The password for authentication with the server')
+@click.option('-s', '--server_url', prompt=True, help='The url for the server')
+@click.option('-a', '--action', type=click.Choice(['download', 'delete']), prompt=True)
+@click.option('--project_path', prompt=True, help="The path of the project, e.g. 'Parent/Child'")
+@click.option('--path', type=click.Path(), help='The directory to download to')
+@click.option('--dry_run', is_flag=True, help='Only show what would be deleted')
+@click.option('--workers', default=8, help='Number of parallel downloads/deletes')
+def project_tree_cli(action, project_path, path, dry_run, workers, username, password, server_url):
+    wrapper, server = authenticate_cli(username, password, server_url, use_daemon=False)
+    if action == 'download':
+        print_plan(wrapper.download_project(project_path, path=path, max_workers=workers, server=server))
+        return
+    # always show the plan first
+    plan = wrapper.delete_project(project_path, dry_run=True, server=server)
+    print_plan(plan)
+    if dry_run or not click.confirm("Delete these {} resources?".format(len(plan))):
+        return
+    # run exactly the confirmed plan
+    print_plan(wrapper.execute_project_delete_plan(plan, max_workers=workers, server=server))
+
+
 @cli.command(help='Update workbook, datasource or project')
 @click.option('-u', '--username', prompt=True, help='The username for authentication with the server')
 @click.option('-p', '--password', prompt=True, hide_input=True, help='The password for authentication with the server')
@@ -194,17 +418,18 @@ def delete_cli(object_name, object_type, project_name, username, password, serve
 @click.option('-on', '--object_name')
 @click.option('-n', '--new_name')
 def update_cli(project_name, object_type, object_name, new_name, username, password, server_url):
-    server = authenticate_cli(username, password, server_url)
+    wrapper, server = authenticate_cli(username, password, server_url)
+    # start fetching the listings while the user is still choosing
+    if object_name is None:
+        listings = prefetch_listings(wrapper, server, [object_type] if object_type else ['workbook', 'datasource', 'project'])
     # if user hasn't specified yet what the resource_type is let them choose one
     if object_type is None:
         object_type, _ = pick.pick(['workbook', 'datasource', 'project'],
                                         title='What do you want to update?', indicator='->')
     # if user hasn't specified a resource_name yet let them pick one
     if object_name is None:
-        # get list of all the objects on the server of chosen type
-        all_objects = TW.get_resource_list(object_type, server)
-        # let user select one of the objects
-        resource_object, _, object_name = pick_object(all_objects, object_type)
+        # let user select one of the objects of chosen type
+        resource_object, _, object_name = pick_streamed(listings[object_type])
     if object_type == "workbook" or object_type == "datasource":
         project_name = resource_object.project_name
     else:
@@ -212,7 +437,55 @@ def update_cli(project_name, object_type, object_name, new_name, username, passw
     # refresh the resource
     if new_name is None:
         new_name = input("Enter the new name for the {}:\n".format(object_type))
-    TW.update(object_type, new_name, object_name, project_name, server=server)
+    wrapper.update(object_type, new_name, object_name, project_name, server=server)
+
+
+@cli.command(help='Export an inventory of the projects, workbooks, datasources and views to CSV/Parquet')
+@click.option('-u', '--username', prompt=True, help='The username for authentication with the server')
+@click.option('-p', '--password', prompt=True, hide_input=True, help='The password for authentication with the server')
+@click.option('-s', '--server_url', prompt=True, help='The url for the server')
+@click.option('-o', '--output', type=click.Path(), prompt="Please enter the path of the .csv or .parquet file")
+@click.option('--incremental', is_flag=True, help='Only export what changed since the previous export')
+def inventory_cli(output, incremental, username, password, server_url):
+    wrapper, server = authenticate_cli(username, password, server_url)
+    row_count = wrapper.export_inventory(output, incremental=incremental, server=server)
+    print("Exported {} resources to {}".format(row_count, output))
+
+
+@cli.command(help='Diff two sites and promote the changes from the source to the target')
+@click.option('--source_url', prompt=True, help='The url of the server to promote from')
+@click.option('--source_username', prompt=True)
+@click.option('--source_password', prompt=True, hide_input=True)
+@click.option('--target_url', prompt=True, help='The url of the server to promote to')
+@click.option('--target_username', prompt=True)
+@click.option('--target_password', prompt=True, hide_input=True)
+@click.option('--compare', type=click.Choice(['updated_at', 'content']), default='updated_at')
+@click.option('--include_removed', is_flag=True, help='Also delete what is only on the target')
+@click.option('--dry_run', is_flag=True, help='Only show the plan')
+@click.option('--workers', default=8, help='Number of parallel downloads/publishes')
+def promote_cli(source_url, source_username, source_password, target_url, target_username, target_password,
+                compare, include_removed, dry_run, workers):
+    _, source = authenticate_cli(source_username, source_password, source_url, use_daemon=False)
+    _, target = authenticate_cli(target_username, target_password, target_url, use_daemon=False)
+    diff = TW.diff_sites(source, target, compare=compare, max_workers=workers)
+    plan = TW.promotion_plan(diff, include_removed=include_removed)
+    for step in plan:
+        record = step["record"]
+        print("{} {} '{}/{}'".format(step["action"], record["resource_type"], record["project_path"], record["name"]))
+    if dry_run or not plan or not click.confirm("Execute these {} steps?".format(len(plan))):
+        return
+    for step in TW.execute_promotion_plan(plan, source, target, max_workers=workers):
+        if step["status"] == "failed":
+            print("failed {} '{}': {}".format(step["action"], step["record"]["name"], step["error"]))
+
+
+@cli.command(help='Run a local daemon keeping sessions and lookups warm for the CLI and scripts')
+@click.option('--port', default=0, help='The port to listen on (a free one by default)')
+@click.option('--workers', default=4, help='Number of operations running concurrently')
+@click.option('--cache_ttl', default=300, help='Seconds lookups stay cached')
+def serve(port, workers, cache_ttl):
+    print("Serving on 127.0.0.1, stop with Ctrl-C")
+    TD.serve(port=port, workers=workers, cache_ttl=cache_ttl)
 
 
 if __name__ == "__main__":
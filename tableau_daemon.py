@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+
+import tableau_wrapper as TW
+import tableauserverclient as TSC
+import builtins
+import hashlib
+import http.server
+import inspect
+import ipaddress
+import itertools
+import json
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+import types
+import urllib.request
+
+
+# file the running daemon announces its address and token in
+DAEMON_FILE = os.path.join(TW.STATE_DIR, "daemon.json")
+
+# read-only lookups whose results get cached per session
+CACHED_OPERATIONS = ("get_project_id", "get_resource_id", "get_resource_list",
+                     "get_resource_records")
+
+# operations changing the server, they invalidate the session's cache
+MUTATING_OPERATIONS = ("publish", "publish_incremental", "refresh", "delete",
+                       "update", "create", "bulk_delete", "bulk_rename",
+                       "execute_bulk_plan")
+
+# all the wrapper functions the daemon runs on behalf of a client
+OPERATIONS = CACHED_OPERATIONS + MUTATING_OPERATIONS + (
+    "download", "download_view_image", "download_view_pdf",
+    "download_view_csv", "export_inventory")
+
+# operation only signing in, to check the credentials before the first
+# real operation
+SIGN_IN = "sign_in"
+
+# attributes of TSC items sent back to the client
+ITEM_FIELDS = ("id", "name", "project_id", "project_name", "parent_id",
+               "owner_id", "workbook_id", "content_url", "size",
+               "created_at", "updated_at")
+
+
+class DaemonError(RuntimeError):
+    """
+    Error raised by the daemon that has no builtin equivalent
+    """
+
+
+def _to_json(value):
+    """
+    Convert the return value of a wrapper function into JSON-serializable
+    data, TSC items get flattened to the attributes in ITEM_FIELDS
+    """
+
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return (value)
+    if isinstance(value, (list, tuple)):
+        return ([_to_json(element) for element in value])
+    if isinstance(value, dict):
+        return ({key: _to_json(element) for key, element in value.items()})
+    if hasattr(value, "isoformat"):
+        return (value.isoformat())
+    item = {}
+    for field in ITEM_FIELDS:
+        field_value = getattr(value, field, None)
+        if field_value is not None:
+            item[field] = _to_json(field_value)
+    return ({"__item__": item})
+
+
+def _from_json(value):
+    """
+    Inverse of _to_json, items become attribute objects again
+    """
+
+    if isinstance(value, list):
+        return ([_from_json(element) for element in value])
+    if isinstance(value, dict):
+        if "__item__" in value:
+            item = dict.fromkeys(ITEM_FIELDS)
+            item.update(value["__item__"])
+            return (types.SimpleNamespace(**item))
+        return ({key: _from_json(element) for key, element in value.items()})
+    return (value)
+
+
+def _is_auth_error(err):
+    """
+    True if err means the session expired or got signed out
+    """
+
+    if isinstance(err, TSC.NotSignedInError):
+        return (True)
+    code = str(getattr(err, "code", ""))
+    return (code.startswith("401"))
+
+
+class _Job(object):
+    """
+    An operation submitted to the daemon, waiting for a worker
+    """
+
+    def __init__(self, operation, credentials, arguments):
+        self.operation = operation
+        self.credentials = credentials
+        self.arguments = arguments
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Daemon(object):
+    """
+    Runs wrapper operations on a worker pool with warm, authenticated server
+    sessions and cached lookups
+    """
+
+    def __init__(self, workers=4, cache_ttl=300):
+        self.cache_ttl = cache_ttl
+        self.jobs = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.sessions = {}
+        self.session_lock = threading.Lock()
+        # one lock per session key, so only jobs of the same credentials
+        # wait for a sign-in
+        self.sign_in_locks = {}
+        self.cache = {}
+        self.cache_lock = threading.Lock()
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0,
+                         "sign_ins": 0, "cache_hits": 0}
+        self.counters_lock = threading.Lock()
+        self.workers = [threading.Thread(target=self._work, daemon=True)
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def _count(self, counter):
+        # the counters get updated from the workers and handler threads
+        with self.counters_lock:
+            self.counters[counter] += 1
+
+    def _session_key(self, credentials):
+        # the password is part of the key so a session can only be used with
+        # the credentials it got signed in with
+        digest = hashlib.sha256(
+            credentials["password"].encode("utf-8")).hexdigest()
+        return ((credentials["server_url"], credentials["username"], digest))
+
+    def _get_session(self, credentials, expired=None):
+        # expired is the session that got signed out, to replace it
+        key = self._session_key(credentials)
+        with self.session_lock:
+            server = self.sessions.get(key)
+            if server is not None and server is not expired:
+                return (key, server)
+            sign_in_lock = self.sign_in_locks.setdefault(key,
+                                                         threading.Lock())
+        # sign in without holding session_lock, the other sessions stay
+        # usable meanwhile
+        with sign_in_lock:
+            with self.session_lock:
+                server = self.sessions.get(key)
+            # another job might have signed in while this one was waiting
+            if server is not None and server is not expired:
+                return (key, server)
+            server = TW.authenticate(credentials["server_url"],
+                                     credentials["username"],
+                                     credentials["password"])
+            with self.session_lock:
+                self.sessions[key] = server
+            self._count("sign_ins")
+            self._invalidate(key)
+        return (key, server)
+
+    def _invalidate(self, session_key):
+        with self.cache_lock:
+            for cache_key in [cache_key for cache_key in self.cache
+                              if cache_key[0] == session_key]:
+                del self.cache[cache_key]
+
+    def _call(self, job, session_key, server):
+        operation = job.operation
+        cache_key = (session_key, operation,
+                     json.dumps(job.arguments, sort_keys=True))
+        if operation in CACHED_OPERATIONS:
+            with self.cache_lock:
+                cached = self.cache.get(cache_key)
+            if cached and cached[0] > time.time():
+                self._count("cache_hits")
+                return (cached[1])
+        result = getattr(TW, operation)(server=server, **job.arguments)
+        if operation in CACHED_OPERATIONS:
+            with self.cache_lock:
+                self.cache[cache_key] = (time.time() + self.cache_ttl, result)
+        elif operation in MUTATING_OPERATIONS:
+            self._invalidate(session_key)
+        return (result)
+
+    def _run(self, job):
+        session_key, server = self._get_session(job.credentials)
+        if job.operation == SIGN_IN:
+            return (None)
+        try:
+            return (self._call(job, session_key, server))
+        except Exception as err:
+            if not _is_auth_error(err):
+                raise
+        # the session expired, sign in again and retry once
+        session_key, server = self._get_session(job.credentials,
+                                                expired=server)
+        return (self._call(job, session_key, server))
+
+    def _work(self):
+        while True:
+            _, _, job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                job.result = self._run(job)
+                self._count("completed")
+            except Exception as err:
+                job.error = err
+                self._count("failed")
+            job.done.set()
+
+    def submit(self, operation, credentials, arguments, priority=10):
+        """
+        Queue an operation and wait for its result
+
+        Parameters:
+        operation       -- name of the wrapper function (see OPERATIONS) or
+                           SIGN_IN to only sign in
+        credentials     -- dict with server_url, username and password
+        arguments       -- keyword arguments of the wrapper function
+        priority        -- lower numbers run first
+
+        Return value(s):
+        result          -- return value of the wrapper function
+
+        Exception(s):
+        NameError       -- invalid operation
+        (any error raised by the wrapper function)
+        """
+
+        if operation not in OPERATIONS + (SIGN_IN,):
+            raise NameError("Invalid operation '{}'".format(operation))
+        job = _Job(operation, credentials, arguments)
+        self._count("submitted")
+        self.jobs.put((priority, next(self.sequence), job))
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return (job.result)
+
+    def status(self):
+        with self.counters_lock:
+            status = dict(self.counters)
+        status.update({"queued": self.jobs.qsize(),
+                       "sessions": len(self.sessions),
+                       "cached": len(self.cache)})
+        return (status)
+
+    def close(self):
+        for _ in self.workers:
+            self.jobs.put((float("inf"), next(self.sequence), None))
+        with self.session_lock:
+            for server in self.sessions.values():
+                try:
+                    server.auth.sign_out()
+                except Exception:
+                    pass
+            self.sessions.clear()
+
+
+def _make_handler(daemon, token):
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self):
+            return (secrets.compare_digest(
+                self.headers.get("X-Daemon-Token", ""), token))
+
+        def do_GET(self):
+            if not self._authorized():
+                return (self._reply(403, {"error": "forbidden"}))
+            self._reply(200, daemon.status())
+
+        def do_POST(self):
+            if not self._authorized():
+                return (self._reply(403, {"error": "forbidden"}))
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            try:
+                result = daemon.submit(request["operation"],
+                                       request["credentials"],
+                                       request.get("arguments", {}),
+                                       request.get("priority", 10))
+                self._reply(200, {"result": _to_json(result)})
+            except Exception as err:
+                error = {"type": type(err).__name__, "message": str(err)}
+                # the client rebuilds server errors from their parts
+                if isinstance(err, TSC.ServerResponseError):
+                    error.update({"code": err.code, "summary": err.summary,
+                                  "detail": err.detail})
+                self._reply(200, {"error": error})
+
+        def log_message(self, format, *args):
+            pass
+
+    return (Handler)
+
+
+def serve(host="127.0.0.1", port=0, workers=4, cache_ttl=300,
+          daemon_file=None):
+    """
+    Run the daemon until interrupted.
+    The address and a random access token get written to daemon_file (only
+    readable by the current user), clients find the daemon through it.
+    The daemon only listens on loopback interfaces, the requests carry the
+    Tableau passwords over plain HTTP.
+
+    Parameters:
+    host            -- loopback interface to listen on (127.0.0.1 by
+                       default)
+    port            -- port to listen on, a free one by default
+    workers         -- number of operations running concurrently
+    cache_ttl       -- seconds lookups stay cached
+    daemon_file     -- path of the daemon file
+                       default: ~/.tableau_wrapper/daemon.json
+
+    Exception(s):
+    NameError       -- host is no loopback interface
+    """
+
+    if not ipaddress.ip_address(socket.gethostbyname(host)).is_loopback:
+        raise NameError("Invalid host '{}', the daemon only listens on "
+                        "loopback interfaces".format(host))
+    if daemon_file is None:
+        daemon_file = DAEMON_FILE
+    token = secrets.token_hex(32)
+    daemon = Daemon(workers=workers, cache_ttl=cache_ttl)
+    httpd = http.server.ThreadingHTTPServer((host, port),
+                                            _make_handler(daemon, token))
+    os.makedirs(os.path.dirname(daemon_file), exist_ok=True)
+    fd = os.open(daemon_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as info_file:
+        json.dump({"host": host, "port": httpd.server_address[1],
+                   "token": token, "pid": os.getpid()}, info_file)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        daemon.close()
+        if os.path.exists(daemon_file):
+            os.remove(daemon_file)
+
+
+def _request(info, method, body=None, timeout=None):
+    url = "http://{}:{}/".format(info["host"], info["port"])
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method,
+                                     headers={"X-Daemon-Token": info["token"],
+                                              "Content-Type":
+                                                  "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return (json.loads(response.read().decode("utf-8")))
+
+
+def daemon_running(daemon_file=None):
+    """
+    Check if a daemon is running
+
+    Parameters:
+    daemon_file     -- path of the daemon file
+                       default: ~/.tableau_wrapper/daemon.json
+
+    Return value(s):
+    info            -- address and token of the daemon, None if there is no
+                       daemon running
+    """
+
+    if daemon_file is None:
+        daemon_file = DAEMON_FILE
+    try:
+        with open(daemon_file) as info_file:
+            info = json.load(info_file)
+        _request(info, "GET", timeout=0.5)
+    except (OSError, ValueError):
+        return (None)
+    return (info)
+
+
+def call(info, operation, credentials, arguments, priority=10):
+    """
+    Run a wrapper function in the daemon
+
+    Parameters:
+    info            -- address and token of the daemon (see daemon_running)
+    operation       -- name of the wrapper function (see OPERATIONS)
+    credentials     -- dict with server_url, username and password
+    arguments       -- keyword arguments of the wrapper function
+    priority        -- lower numbers run first
+
+    Return value(s):
+    result          -- return value of the wrapper function, TSC items come
+                       back as objects with the attributes in ITEM_FIELDS
+
+    Exception(s):
+    (the error raised in the daemon: ServerResponseError and builtin errors
+    get rebuilt, DaemonError for all the others)
+    """
+
+    response = _request(info, "POST", {"operation": operation,
+                                       "credentials": credentials,
+                                       "arguments": arguments,
+                                       "priority": priority})
+    if "error" in response:
+        error = response["error"]
+        if "code" in error:
+            raise TSC.ServerResponseError(error["code"], error["summary"],
+                                          error["detail"])
+        error_class = getattr(builtins, response["error"]["type"], None)
+        if not (isinstance(error_class, type) and
+                issubclass(error_class, Exception)):
+            error_class = DaemonError
+        raise error_class(response["error"]["message"])
+    return (_from_json(response["result"]))
+
+
+class RemoteWrapper(object):
+    """
+    Stand-in for the tableau_wrapper module forwarding the operations to a
+    running daemon. The server object and credentials arguments get dropped,
+    the daemon uses its own warm session for the given credentials.
+    """
+
+    # extensions of the files download_view_* write by default
+    VIEW_EXTENSIONS = {"download_view_image": ".jpeg",
+                       "download_view_pdf": ".pdf",
+                       "download_view_csv": ".csv"}
+
+    def __init__(self, info, server_url, username, password, priority=0):
+        self.info = info
+        self.credentials = {"server_url": server_url, "username": username,
+                            "password": password}
+        self.priority = priority
+
+    def sign_in(self):
+        """
+        Sign in with the credentials in the daemon (or reuse its session)
+
+        Exception(s):
+        ServerResponseError -- authentication failed
+        """
+
+        call(self.info, SIGN_IN, self.credentials, {}, self.priority)
+
+    def __getattr__(self, operation):
+        function = getattr(TW, operation)
+        if operation not in OPERATIONS:
+            return (function)
+        signature = inspect.signature(function)
+
+        def remote(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            for name in ("server", "server_url", "username", "password"):
+                arguments.pop(name, None)
+            # files are read and written by the daemon, resolve the paths
+            # relative to the working directory of the caller
+            for name in ("path", "source_path"):
+                if arguments.get(name):
+                    arguments[name] = os.path.abspath(arguments[name])
+            if operation == "download" and not arguments.get("path"):
+                arguments["path"] = os.getcwd()
+            if (operation in self.VIEW_EXTENSIONS and
+                    not arguments.get("path")):
+                arguments["path"] = os.path.join(
+                    os.getcwd(), arguments["resource_name"] +
+                    self.VIEW_EXTENSIONS[operation])
+            return (call(self.info, operation, self.credentials,
+                         dict(arguments), self.priority))
+        return (remote)
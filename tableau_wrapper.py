@@ -1,7 +1,115 @@
 #!/usr/bin/env python3
 
 import tableauserverclient as TSC
+import requests
+import concurrent.futures
+import copy
+import csv
+import datetime
+import fnmatch
+import functools
+import hashlib
+import inspect
+import io
+import json
 import os
+import queue
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+import zipfile
+
+
+# calls currently running per key and per operation counters of how many
+# identical concurrent calls shared them (see single_flight)
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+coalescing_counters = {}
+
+
+class _Flight(object):
+    """
+    A call in flight, the calls with the same key wait for its outcome
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def single_flight(function):
+    """
+    Decorator coalescing concurrent identical calls of a read-only function:
+    while a call is running, calls with the same arguments (the server object
+    by identity) wait for it and share its result or error instead of making
+    their own request. Every caller gets its own copy of the result, so
+    callers can mutate or populate the returned items (e.g. populate_pdf,
+    renaming) without affecting each other. Only use it for functions
+    without side effects on the server.
+    """
+
+    signature = inspect.signature(function)
+    name = function.__name__
+    counters = coalescing_counters.setdefault(name, {"calls": 0,
+                                                     "coalesced": 0})
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (name,) + tuple(
+            (argument, id(value) if argument == "server" else value)
+            for argument, value in bound.arguments.items())
+        try:
+            hash(key)
+        except TypeError:
+            # arguments that can't be compared are never coalesced
+            return (function(*args, **kwargs))
+        with _in_flight_lock:
+            counters["calls"] += 1
+            flight = _in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _in_flight[key] = _Flight()
+            else:
+                counters["coalesced"] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return (copy.deepcopy(flight.result))
+        try:
+            result = function(*args, **kwargs)
+            # keep an untouched copy for the followers, the leader may
+            # mutate its result as soon as it got returned
+            flight.result = copy.deepcopy(result)
+            return (result)
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with _in_flight_lock:
+                del _in_flight[key]
+            flight.done.set()
+    return (wrapper)
+
+
+def get_coalescing_stats():
+    """
+    Get how many calls of the single_flight operations got deduplicated
+
+    Return value(s):
+    stats           -- dict operation -> {'calls': n, 'coalesced': n}
+    """
+
+    with _in_flight_lock:
+        return ({name: dict(counters)
+                 for name, counters in coalescing_counters.items()})
 
 
 def publish(resource_type, project_name, path, mode, server_url=None,
@@ -266,6 +374,7 @@ def create(project_name, description=None, content_permissions=None,
     return (new_project.id)
 
 
+@single_flight
 def download(resource_type, resource_name, project_name, server_url=None,
              username=None, password=None, path=None, server=None,
              include_extract=True):
@@ -321,6 +430,7 @@ def download(resource_type, resource_name, project_name, server_url=None,
     return (file_path)
 
 
+@single_flight
 def download_view_image(resource_name, server_url=None, username=None,
                         password=None, path=None, server=None,
                         resolution="high"):
@@ -379,6 +489,7 @@ def download_view_image(resource_name, server_url=None, username=None,
     return (path)
 
 
+@single_flight
 def download_view_pdf(resource_name, project_name, server_url=None,
                       username=None, password=None, path=None, server=None,
                       orientation='portrait', filter_key=None,
@@ -444,6 +555,7 @@ def download_view_pdf(resource_name, project_name, server_url=None,
     return (path)
 
 
+@single_flight
 def download_view_csv(resource_name, project_name, server_url=None,
                       username=None, password=None, path=None, server=None,
                       filter_key=None, filter_value=None):
@@ -553,6 +665,7 @@ def authenticate(server_url, username, password):
         raise
 
 
+@single_flight
 def get_project_id(project_name, server):
     """
     Get the ID of a project
@@ -583,6 +696,7 @@ def get_project_id(project_name, server):
     return (project_object.id, project_object)
 
 
+@single_flight
 def get_resource_id(resource_type, resource_name, project_name, server):
     """
     Get the ID of a workbook or view
@@ -654,3 +768,2300 @@ def get_resource_list(resource_type, server):
     else:
         raise NameError("Invalid resource_type '{}'".format(resource_type))
     return (all_resources)
+
+
+# default location of the local state (watermarks etc.) of the wrapper
+STATE_DIR = os.path.join(os.path.expanduser("~"), ".tableau_wrapper")
+
+
+def _load_state(path):
+    """
+    Load a local JSON state file, an empty dict if it doesn't exist yet
+    """
+
+    if not os.path.exists(path):
+        return ({})
+    with open(path) as state_file:
+        return (json.load(state_file))
+
+
+def _save_state(path, state):
+    """
+    Atomically write a local JSON state file
+    """
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as state_file:
+        json.dump(state, state_file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return (value)
+    return (datetime.datetime.fromisoformat(value))
+
+
+def _parse_date(value):
+    if isinstance(value, datetime.date):
+        return (value)
+    return (datetime.date.fromisoformat(value))
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return (value)
+    return (str(value).strip().lower() in ("1", "true", "t", "yes", "y"))
+
+
+# column types supported for delta extracts and how to parse a raw value
+_COLUMN_PARSERS = {
+    "text": str,
+    "int": int,
+    "double": float,
+    "bool": _parse_bool,
+    "date": _parse_date,
+    "timestamp": _parse_timestamp,
+}
+
+
+def _hyper_sql_type(column_type):
+    """
+    Map a column type of _COLUMN_PARSERS to a Hyper API SqlType
+    """
+
+    from tableauhyperapi import SqlType
+    if column_type == "text":
+        return (SqlType.text())
+    elif column_type == "int":
+        return (SqlType.big_int())
+    elif column_type == "double":
+        return (SqlType.double())
+    elif column_type == "bool":
+        return (SqlType.bool())
+    elif column_type == "date":
+        return (SqlType.date())
+    elif column_type == "timestamp":
+        return (SqlType.timestamp())
+    raise NameError("Invalid column type '{}'".format(column_type))
+
+
+def _parquet_column_type(arrow_type):
+    """
+    Map a pyarrow type to a column type of _COLUMN_PARSERS
+    """
+
+    import pyarrow as pa
+    if pa.types.is_boolean(arrow_type):
+        return ("bool")
+    elif pa.types.is_integer(arrow_type):
+        return ("int")
+    elif pa.types.is_floating(arrow_type):
+        return ("double")
+    elif pa.types.is_timestamp(arrow_type):
+        return ("timestamp")
+    elif pa.types.is_date(arrow_type):
+        return ("date")
+    return ("text")
+
+
+# column types a watermark can be compared with
+WATERMARK_TYPES = ("int", "double", "date", "timestamp")
+
+# number of CSV rows looked at to infer the types of the columns
+_INFER_SAMPLE_SIZE = 1000
+
+
+def _infer_column_type(values):
+    """
+    Infer the narrowest of WATERMARK_TYPES all the (non-empty) values parse
+    as, 'text' if there is none
+    """
+
+    values = [value for value in values if value not in ("", None)]
+    for column_type in WATERMARK_TYPES:
+        try:
+            for value in values:
+                _COLUMN_PARSERS[column_type](value)
+        except ValueError:
+            continue
+        if values:
+            return (column_type)
+    return ("text")
+
+
+def _iter_source_rows(source_path, columns, batch_size,
+                      watermark_column=None, watermark_type=None):
+    """
+    Stream the rows of a local CSV or Parquet file as dicts, batch by batch
+
+    Parameters:
+    source_path      -- path of the .csv or .parquet file
+    columns          -- list of (column_name, column_type) tuples or None to
+                        take all columns of the file (CSV column types get
+                        inferred from the first rows, Parquet ones taken
+                        from the schema)
+    batch_size       -- number of rows read from a Parquet file at once
+    watermark_column -- name of the column tracking new rows
+    watermark_type   -- type of the watermark_column if columns is None
+                        default: inferred like the other columns
+
+    Return value(s):
+    columns         -- list of (column_name, column_type) tuples
+    rows            -- generator of dicts with parsed values
+
+    Exception(s):
+    NameError       -- if the file is neither CSV nor Parquet
+    """
+
+    extension = os.path.splitext(source_path)[1].lower()
+    if extension == ".csv":
+        if columns is None:
+            with open(source_path, newline="") as source_file:
+                reader = csv.reader(source_file)
+                header = next(reader)
+                sample = [row for row, _ in
+                          zip(reader, range(_INFER_SAMPLE_SIZE))]
+            # the extract has to match the column types of the datasource
+            columns = [(name, _infer_column_type(
+                            row[position] for row in sample
+                            if position < len(row)))
+                       for position, name in enumerate(header)]
+            if watermark_type is not None:
+                columns = [(name, watermark_type if name == watermark_column
+                            else column_type) for name, column_type in columns]
+        parsers = [(name, _COLUMN_PARSERS[column_type])
+                   for name, column_type in columns]
+
+        def rows():
+            with open(source_path, newline="") as source_file:
+                for record in csv.DictReader(source_file):
+                    yield {name: (parser(record[name])
+                                  if record[name] not in ("", None) else None)
+                           for name, parser in parsers}
+    elif extension in (".parquet", ".pq"):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(source_path)
+        if columns is None:
+            columns = [(field.name,
+                        watermark_type if field.name == watermark_column and
+                        watermark_type else _parquet_column_type(field.type))
+                       for field in parquet_file.schema_arrow]
+        names = [name for name, _ in columns]
+
+        def rows():
+            for batch in parquet_file.iter_batches(batch_size=batch_size,
+                                                   columns=names):
+                for record in batch.to_pylist():
+                    yield record
+    else:
+        raise NameError("Invalid source file '{}'".format(source_path))
+    return (columns, rows())
+
+
+def build_delta_hyper(source_path, hyper_path, watermark_column,
+                      watermark=None, columns=None, watermark_type=None,
+                      schema_name="Extract", table_name="Extract",
+                      batch_size=10000):
+    """
+    Build a .hyper file containing only the rows of a local CSV or Parquet
+    file whose watermark_column is greater than watermark. The source gets
+    streamed into the extract, it never gets loaded into memory as a whole.
+    Rows with the same watermark_column value as watermark count as already
+    published (they are left out even if they got added to the file later),
+    rows without a watermark_column value can't be tracked and get skipped.
+    Requires the tableauhyperapi package (and pyarrow for Parquet files).
+
+    Parameters:
+    source_path      -- path of the .csv or .parquet file
+    hyper_path       -- path of the .hyper file to create
+    watermark_column -- name of the column tracking new rows (e.g. a
+                        timestamp or an increasing id)
+    watermark        -- last watermark already published, None for all rows
+    columns          -- list of (column_name, column_type) tuples, types
+                        'text'/'int'/'double'/'bool'/'date'/'timestamp'
+                        default: all columns of the file, CSV types
+                        inferred from the first rows
+    watermark_type   -- type of the watermark_column if columns is None
+                        ('int'/'double'/'date'/'timestamp')
+                        default: inferred from the file
+    schema_name      -- schema of the table in the extract
+    table_name       -- name of the table in the extract
+    batch_size       -- number of rows read from a Parquet file at once
+
+    Return value(s):
+    row_count        -- number of rows written to the extract
+    new_watermark    -- highest watermark_column value written (or the old
+                        watermark if there were no new rows)
+    skipped_count    -- number of rows skipped for an empty watermark_column
+
+    Exception(s):
+    NameError        -- invalid source file, column type or watermark_column
+    TypeError        -- the watermark_column is no number, date or timestamp
+                        (text watermarks don't compare like the values)
+    """
+
+    from tableauhyperapi import (HyperProcess, Telemetry, Connection,
+                                 CreateMode, TableDefinition, TableName,
+                                 Inserter)
+    columns, rows = _iter_source_rows(source_path, columns, batch_size,
+                                      watermark_column, watermark_type)
+    column_types = dict(columns)
+    if watermark_column not in column_types:
+        raise NameError("Invalid watermark_column '{}'".format(
+            watermark_column))
+    if column_types[watermark_column] not in WATERMARK_TYPES:
+        raise TypeError("watermark_column '{}' has type '{}', it has to be "
+                        "one of {}".format(watermark_column,
+                                           column_types[watermark_column],
+                                           "/".join(WATERMARK_TYPES)))
+    # the stored watermark is serialized, parse it like the column values
+    if watermark is not None:
+        watermark = _COLUMN_PARSERS[column_types[watermark_column]](watermark)
+    names = [name for name, _ in columns]
+    progress = {"row_count": 0, "watermark": watermark, "skipped_count": 0}
+
+    def new_rows():
+        for record in rows:
+            value = record[watermark_column]
+            if value is None:
+                progress["skipped_count"] += 1
+                continue
+            if watermark is not None and value <= watermark:
+                continue
+            if progress["watermark"] is None or value > progress["watermark"]:
+                progress["watermark"] = value
+            progress["row_count"] += 1
+            yield [record[name] for name in names]
+
+    table = TableDefinition(TableName(schema_name, table_name),
+                            [TableDefinition.Column(name,
+                                                    _hyper_sql_type(type_))
+                             for name, type_ in columns])
+    with HyperProcess(
+            telemetry=Telemetry.DO_NOT_SEND_USAGE_DATA_TO_TABLEAU) as hyper:
+        with Connection(endpoint=hyper.endpoint, database=hyper_path,
+                        create_mode=CreateMode.CREATE_AND_REPLACE) as conn:
+            conn.catalog.create_schema_if_not_exists(schema_name)
+            conn.catalog.create_table(table)
+            with Inserter(conn, table) as inserter:
+                inserter.add_rows(new_rows())
+                inserter.execute()
+    return (progress["row_count"], progress["watermark"],
+            progress["skipped_count"])
+
+
+def publish_incremental(datasource_name, project_name, source_path,
+                        watermark_column, columns=None, watermark_type=None,
+                        initial_watermark=None, watermark_path=None,
+                        schema_name="Extract",
+                        table_name="Extract",
+                        batch_size=10000, server_url=None, username=None,
+                        password=None, server=None):
+    """
+    Append the rows of a local CSV or Parquet file that are newer than the
+    last published watermark to a datasource.
+    The watermark (max value of watermark_column) is stored locally per
+    server, site and datasource, so only the delta gets built and uploaded
+    on every call. Without a stored watermark the rows newer than
+    initial_watermark get appended, without initial_watermark either the
+    whole file gets published with mode 'Overwrite' (the datasource holds
+    exactly the rows of the file afterwards, appending them could duplicate
+    the rows it already has).
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    datasource_name  -- name of the datasource to append to
+    project_name     -- name of the project the datasource is stored in
+    source_path      -- path of the .csv or .parquet file
+    watermark_column -- name of the column tracking new rows
+    columns          -- list of (column_name, column_type) tuples
+                        default: all columns of the file
+    watermark_type   -- type of the watermark_column if columns is None
+                        ('int'/'double'/'date'/'timestamp')
+                        default: inferred from the file
+    initial_watermark -- highest watermark_column value the datasource
+                        already holds, used if there is no stored watermark
+    watermark_path   -- path of the watermark file
+                        default: ~/.tableau_wrapper/watermarks.json
+    schema_name      -- schema of the table in the extract
+    table_name       -- name of the table in the extract
+    batch_size       -- number of rows read from a Parquet file at once
+    server_url       -- the url of the server to connect with
+    username         -- username of the user to authenticate with
+    password         -- password of the user to authenticate with
+    server           -- the server object if authenticated previosly
+
+    Return value(s):
+    resource_id      -- ID of the datasource, None if there were no new rows
+    row_count        -- number of rows appended
+    skipped_count    -- number of rows skipped for an empty watermark_column
+
+    Exception(s):
+    NameError        -- invalid source file, column type or watermark_column
+    TypeError        -- the watermark_column is no number, date or timestamp
+    """
+
+    if watermark_path is None:
+        watermark_path = os.path.join(STATE_DIR, "watermarks.json")
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    key = "{}/{}/{}/{}".format(server.server_address, server.site_id,
+                               project_name, datasource_name)
+    watermark = _load_state(watermark_path).get(key)
+    mode = "Append"
+    if watermark is None:
+        watermark = initial_watermark
+        # first run without a known watermark: replace the contents instead
+        # of appending rows the datasource might already hold
+        if watermark is None:
+            mode = "Overwrite"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the name of the file is the name of the datasource to append to
+        hyper_path = os.path.join(tmp_dir, datasource_name + ".hyper")
+        row_count, new_watermark, skipped_count = build_delta_hyper(
+            source_path, hyper_path, watermark_column, watermark=watermark,
+            columns=columns, watermark_type=watermark_type,
+            schema_name=schema_name, table_name=table_name,
+            batch_size=batch_size)
+        resource_id = None
+        if row_count > 0:
+            resource_id = publish("datasource", project_name, hyper_path,
+                                  mode, server=server)
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    if new_watermark is None:
+        return (None, 0, skipped_count)
+    # only move the watermark once the delta got published
+    if isinstance(new_watermark, (datetime.date, datetime.datetime)):
+        new_watermark = new_watermark.isoformat()
+    watermarks = _load_state(watermark_path)
+    watermarks[key] = new_watermark
+    _save_state(watermark_path, watermarks)
+    return (resource_id, row_count, skipped_count)
+
+
+def _get_endpoint(resource_type, server):
+    """
+    Get the server endpoint of the resource_type
+    """
+
+    if resource_type == "workbook":
+        return (server.workbooks)
+    elif resource_type == "datasource":
+        return (server.datasources)
+    elif resource_type == "project":
+        return (server.projects)
+    elif resource_type == "view":
+        return (server.views)
+    raise NameError("Invalid resource_type '{}'".format(resource_type))
+
+
+def get_all_resources(resource_type, server, req_options=None, page_size=1000):
+    """
+    Get all the resources of type resource_type on the server, paging
+    through the whole listing
+
+    Parameters:
+    resource_type   -- type of the resources
+                       'workbook'/'view'/'datasource'/'project'
+    server          -- the server object
+    req_options     -- TSC.RequestOptions with filters (optional)
+    page_size       -- number of resources requested per call
+
+    Return value(s):
+    all_resources   -- generator of all resources as objects
+
+    Exception(s):
+    NameError       -- invalid resource_type
+    """
+
+    endpoint = _get_endpoint(resource_type, server)
+    if req_options is None:
+        req_options = TSC.RequestOptions()
+    req_options.pagesize = page_size
+    return (iter(TSC.Pager(endpoint, req_options)))
+
+
+def _is_transient_error(err):
+    """
+    True if retrying might help: server errors (5xx), rate limiting (429),
+    connection errors and timeouts. Not for e.g. 403 or 404, those won't go
+    away by trying again.
+    """
+
+    if isinstance(err, (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout, ConnectionError,
+                        TimeoutError)):
+        return (True)
+    code = str(getattr(err, "code", ""))
+    return (code.startswith("5") or code.startswith("429"))
+
+
+def _run_with_retries(action, item, retries, backoff):
+    """
+    Run action(item), retrying transient errors with exponential backoff
+    Returns the number of attempts, the result and the error (if it failed)
+    """
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return (attempt, action(item), None)
+        except Exception as err:
+            if attempt > retries or not _is_transient_error(err):
+                return (attempt, None, err)
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def run_parallel(action, items, max_workers=8, retries=2, backoff=1.0):
+    """
+    Run action on every item on a bounded worker pool
+
+    Parameters:
+    action          -- function taking one item
+    items           -- iterable of items
+    max_workers     -- maximum number of concurrent workers
+    retries         -- number of retries per item if the action fails with
+                       a transient error (5xx, 429, connection, timeout)
+    backoff         -- seconds to wait before the first retry (doubles on
+                       every further retry)
+
+    Return value(s):
+    results         -- list of (item, attempts, result, error) tuples in the
+                       order of items, error is None if the action succeeded
+    """
+
+    items = list(items)
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(_run_with_retries, action, item, retries,
+                                   backoff)
+                   for item in items]
+        return ([(item,) + future.result()
+                 for item, future in zip(items, futures)])
+
+
+def select_resources(resource_type, server, project_name=None,
+                     name_pattern=None, owner_name=None,
+                     older_than_days=None):
+    """
+    Select the resources of type resource_type matching all the given
+    criteria. Project, owner and age get filtered on the server, so only a
+    few list calls are needed.
+
+    Parameters:
+    resource_type   -- workbook, datasource or project
+    server          -- the server object
+    project_name    -- name of the project the resources are stored in
+                       (parent project for projects)
+    name_pattern    -- shell-style pattern the name has to match ('tmp_*')
+    owner_name      -- name of the owner (workbooks and datasources only)
+    older_than_days -- only resources last updated more than
+                       older_than_days ago (workbooks and datasources only)
+
+    Return value(s):
+    resources       -- list of the matching resources as objects
+
+    Exception(s):
+    NameError       -- invalid resource_type
+    TypeError       -- owner_name or older_than_days used for projects
+    """
+
+    if resource_type not in ("workbook", "datasource", "project"):
+        raise NameError("Invalid resource_type '{}'".format(resource_type))
+    options = TSC.RequestOptions()
+    parent_id = None
+    if resource_type == "project":
+        if owner_name or older_than_days is not None:
+            raise TypeError("owner_name and older_than_days are not "
+                            "supported for projects")
+        if project_name:
+            parent_id, _ = get_project_id(project_name, server)
+    else:
+        if project_name:
+            options.filter.add(TSC.Filter(
+                TSC.RequestOptions.Field.ProjectName,
+                TSC.RequestOptions.Operator.Equals, project_name))
+        if owner_name:
+            options.filter.add(TSC.Filter(
+                TSC.RequestOptions.Field.OwnerName,
+                TSC.RequestOptions.Operator.Equals, owner_name))
+        if older_than_days is not None:
+            cutoff = (datetime.datetime.utcnow() -
+                      datetime.timedelta(days=older_than_days))
+            options.filter.add(TSC.Filter(
+                TSC.RequestOptions.Field.UpdatedAt,
+                TSC.RequestOptions.Operator.LessThan,
+                cutoff.strftime("%Y-%m-%dT%H:%M:%SZ")))
+    resources = []
+    for resource in get_all_resources(resource_type, server, options):
+        if parent_id is not None and resource.parent_id != parent_id:
+            continue
+        if name_pattern and not fnmatch.fnmatchcase(resource.name,
+                                                    name_pattern):
+            continue
+        resources.append(resource)
+    return (resources)
+
+
+def _plan_entry(resource_type, resource, action, new_name=None):
+    return ({"resource_type": resource_type,
+             "id": resource.id,
+             "name": resource.name,
+             "project_name": getattr(resource, "project_name", None),
+             "action": action,
+             "new_name": new_name,
+             "status": "planned",
+             "attempts": 0,
+             "error": None})
+
+
+def _execute_plan(plan, resources, act, max_workers, retries):
+    """
+    Run act(resource, entry) for every entry of the plan and fill in the
+    per-item results
+    """
+
+    by_id = {resource.id: resource for resource in resources}
+    results = run_parallel(lambda entry: act(by_id[entry["id"]], entry),
+                           plan, max_workers=max_workers, retries=retries)
+    for entry, attempts, _, error in results:
+        entry["attempts"] = attempts
+        entry["status"] = "failed" if error else "done"
+        entry["error"] = str(error) if error else None
+    return (plan)
+
+
+def bulk_delete(resource_type, project_name=None, name_pattern=None,
+                owner_name=None, older_than_days=None, dry_run=True,
+                max_workers=8, retries=2, server_url=None, username=None,
+                password=None, server=None):
+    """
+    Delete all the workbooks, datasources or projects matching the given
+    criteria on a bounded worker pool.
+    Deleting a project deletes all its sub-projects, workbooks and
+    datasources as well, so the plan of projects lists their whole subtrees
+    (like delete_project) and gets executed from the deepest level up.
+    With dry_run (default) nothing gets deleted, only the plan is returned,
+    pass it to execute_bulk_plan to delete exactly what it lists.
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    resource_type   -- workbook, datasource or project
+    project_name    -- name of the project the resources are stored in
+                       (parent project for projects)
+    name_pattern    -- shell-style pattern the name has to match ('tmp_*')
+    owner_name      -- name of the owner (workbooks and datasources only)
+    older_than_days -- only resources last updated more than
+                       older_than_days ago (workbooks and datasources only)
+    dry_run         -- only plan, don't delete (default True)
+    max_workers     -- maximum number of concurrent deletes
+    retries         -- number of retries per resource if the delete fails
+    server_url      -- the url of the server to connect with
+    username        -- username of the user to authenticate with
+    password        -- password of the user to authenticate with
+    server          -- the server object if authenticated previosly
+
+    Return value(s):
+    plan            -- list of dicts (one per resource) with id, name,
+                       project_name (project path for the subtrees of
+                       projects), action, status
+                       ('planned'/'done'/'failed'), attempts and error
+
+    Exception(s):
+    NameError       -- invalid resource_type
+    """
+
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    resources = select_resources(resource_type, server, project_name,
+                                 name_pattern, owner_name, older_than_days)
+    if resource_type == "project":
+        tree = load_project_tree(server)
+        # projects nested in other matched ones are part of their subtree
+        project_ids = list(dict.fromkeys(
+            project_id for resource in resources
+            for project_id in tree.subtree(resource.id)))
+        plan = _project_delete_plan(tree, project_ids, server)
+    else:
+        plan = [_plan_entry(resource_type, resource, "delete")
+                for resource in resources]
+    if not dry_run:
+        execute_bulk_plan(plan, max_workers, retries, server=server)
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    return (plan)
+
+
+def bulk_rename(resource_type, new_name, project_name=None,
+                name_pattern=None, owner_name=None, older_than_days=None,
+                dry_run=True, max_workers=8, retries=2, server_url=None,
+                username=None, password=None, server=None):
+    """
+    Rename all the workbooks, datasources or projects matching the given
+    criteria on a bounded worker pool.
+    With dry_run (default) nothing gets renamed, only the plan is returned,
+    pass it to execute_bulk_plan to rename exactly what it lists.
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    resource_type   -- workbook, datasource or project
+    new_name        -- format string with the placeholder {name} for the
+                       current name ('{name} (archived)') or a function
+                       taking the current name and returning the new one
+    project_name    -- name of the project the resources are stored in
+                       (parent project for projects)
+    name_pattern    -- shell-style pattern the name has to match ('tmp_*')
+    owner_name      -- name of the owner (workbooks and datasources only)
+    older_than_days -- only resources last updated more than
+                       older_than_days ago (workbooks and datasources only)
+    dry_run         -- only plan, don't rename (default True)
+    max_workers     -- maximum number of concurrent updates
+    retries         -- number of retries per resource if the update fails
+    server_url      -- the url of the server to connect with
+    username        -- username of the user to authenticate with
+    password        -- password of the user to authenticate with
+    server          -- the server object if authenticated previosly
+
+    Return value(s):
+    plan            -- list of dicts (one per resource) with id, name,
+                       project_name, action, new_name, status
+                       ('planned'/'done'/'failed'), attempts and error
+
+    Exception(s):
+    NameError       -- invalid resource_type
+    """
+
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    if callable(new_name):
+        rename = new_name
+    else:
+        rename = lambda name: new_name.format(name=name)
+    resources = select_resources(resource_type, server, project_name,
+                                 name_pattern, owner_name, older_than_days)
+    plan = [_plan_entry(resource_type, resource, "rename",
+                        rename(resource.name))
+            for resource in resources]
+    if not dry_run:
+        execute_bulk_plan(plan, max_workers, retries, server=server)
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    return (plan)
+
+
+def _run_bulk_entries(plan, max_workers, retries, server):
+    """
+    Run the deletes and renames of the plan entries on a bounded worker
+    pool and fill in the per-item results
+    """
+
+    # projects can't be fetched by id, list the ones to rename once
+    renamed_ids = set(entry["id"] for entry in plan
+                      if entry["action"] == "rename" and
+                      entry["resource_type"] == "project")
+    projects = {}
+    if renamed_ids:
+        projects = {project.id: project for project
+                    in get_all_resources("project", server)
+                    if project.id in renamed_ids}
+
+    def act(entry):
+        endpoint = _get_endpoint(entry["resource_type"], server)
+        if entry["action"] == "delete":
+            return (endpoint.delete(entry["id"]))
+        elif entry["action"] == "rename":
+            if entry["resource_type"] == "project":
+                resource = projects[entry["id"]]
+            else:
+                resource = endpoint.get_by_id(entry["id"])
+            resource.name = entry["new_name"]
+            return (endpoint.update(resource))
+        raise NameError("Invalid action '{}'".format(entry["action"]))
+    for entry, attempts, _, error in run_parallel(act, plan, max_workers,
+                                                  retries):
+        entry["attempts"] = attempts
+        entry["status"] = "failed" if error else "done"
+        entry["error"] = str(error) if error else None
+    return (plan)
+
+
+def execute_bulk_plan(plan, max_workers=8, retries=2, server_url=None,
+                      username=None, password=None, server=None):
+    """
+    Execute a plan of bulk_delete or bulk_rename (e.g. after the user
+    confirmed the dry run) on a bounded worker pool. Only the resources
+    listed in the plan get touched, nothing gets selected again. Plans
+    deleting projects get executed like the ones of delete_project.
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    plan            -- plan of bulk_delete or bulk_rename
+    max_workers     -- maximum number of concurrent actions
+    retries         -- number of retries per resource if the action fails
+                       with a transient error
+    server_url      -- the url of the server to connect with
+    username        -- username of the user to authenticate with
+    password        -- password of the user to authenticate with
+    server          -- the server object if authenticated previosly
+
+    Return value(s):
+    plan            -- the plan with status ('done'/'failed'), attempts and
+                       error filled in for every resource
+
+    Exception(s):
+    NameError       -- invalid resource_type or action in the plan
+    """
+
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    if any(entry["action"] == "delete" and entry["resource_type"] == "project"
+           for entry in plan):
+        execute_project_delete_plan(plan, max_workers, retries, server=server)
+    else:
+        _run_bulk_entries(plan, max_workers, retries, server)
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    return (plan)
+
+
+# fixed schema of the rows of the inventory export
+INVENTORY_FIELDS = ("resource_type", "id", "name", "project_id",
+                    "project_name", "parent_id", "owner_id", "workbook_id",
+                    "content_url", "size", "created_at", "updated_at")
+
+
+def _inventory_row(resource_type, item):
+    """
+    Flatten a TSC item into a row of INVENTORY_FIELDS
+    """
+
+    row = [resource_type]
+    for field in INVENTORY_FIELDS[1:]:
+        value = getattr(item, field, None)
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        row.append(value)
+    return (row)
+
+
+def _put_unless_stopped(batches, batch, stop):
+    """
+    Put batch on the bounded batches queue, give up once stop is set (the
+    writer isn't taking batches anymore)
+    """
+
+    while not stop.is_set():
+        try:
+            batches.put(batch, timeout=0.5)
+            return (True)
+        except queue.Full:
+            pass
+    return (False)
+
+
+def _produce_inventory(resource_type, server, changed_since, batch_size,
+                       batches, errors, stop):
+    """
+    Page through all resources of resource_type and put the flattened rows
+    in batches of batch_size on the batches queue, until stop is set
+    """
+
+    try:
+        options = TSC.RequestOptions()
+        # projects have no updated_at, they are always exported in full
+        if changed_since and resource_type != "project":
+            options.filter.add(TSC.Filter(
+                TSC.RequestOptions.Field.UpdatedAt,
+                TSC.RequestOptions.Operator.GreaterThanOrEqual,
+                changed_since))
+        batch = []
+        for item in get_all_resources(resource_type, server, options):
+            batch.append(_inventory_row(resource_type, item))
+            if len(batch) >= batch_size:
+                if not _put_unless_stopped(batches, batch, stop):
+                    return
+                batch = []
+        if batch:
+            _put_unless_stopped(batches, batch, stop)
+    except Exception as err:
+        errors.append(err)
+    finally:
+        # tell the writer this resource_type is done
+        _put_unless_stopped(batches, None, stop)
+
+
+class _CSVInventoryWriter(object):
+
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(INVENTORY_FIELDS)
+
+    def write(self, batch):
+        self.writer.writerows(batch)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetInventoryWriter(object):
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema(
+            [(field, pa.int64() if field == "size" else pa.string())
+             for field in INVENTORY_FIELDS])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, batch):
+        columns = list(zip(*batch))
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(column, type=field.type)
+             for column, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def export_inventory(path, resource_types=("project", "workbook",
+                                           "datasource", "view"),
+                     incremental=False, batch_size=1000, state_path=None,
+                     server_url=None, username=None, password=None,
+                     server=None):
+    """
+    Export an inventory of all the projects, workbooks, datasources and
+    views on the site to a CSV or Parquet file (by the extension of path).
+    The resource types get paged through concurrently and the rows get
+    streamed to the file in batches, the listings are never held in memory.
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    path            -- path of the .csv or .parquet file to write
+    resource_types  -- resource types to export
+    incremental     -- only export the resources changed since the previous
+                       export of the site (projects are always exported)
+    batch_size      -- number of rows written at once
+    state_path      -- path of the file keeping the time of the last export
+                       default: ~/.tableau_wrapper/inventory.json
+    server_url      -- the url of the server to connect with
+    username        -- username of the user to authenticate with
+    password        -- password of the user to authenticate with
+    server          -- the server object if authenticated previosly
+
+    Return value(s):
+    row_count       -- number of rows written
+
+    Exception(s):
+    NameError       -- invalid file extension or resource_type
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        writer_class = _CSVInventoryWriter
+    elif extension in (".parquet", ".pq"):
+        writer_class = _ParquetInventoryWriter
+    else:
+        raise NameError("Invalid inventory file '{}'".format(path))
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    for resource_type in resource_types:
+        _get_endpoint(resource_type, server)
+    if state_path is None:
+        state_path = os.path.join(STATE_DIR, "inventory.json")
+    site_key = "{}/{}".format(server.server_address, server.site_id)
+    changed_since = None
+    if incremental:
+        changed_since = _load_state(state_path).get(site_key)
+    started_at = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    # bounded queue, the producers wait while the writer is behind
+    batches = queue.Queue(maxsize=2 * len(resource_types))
+    errors = []
+    stop = threading.Event()
+    producers = [threading.Thread(target=_produce_inventory,
+                                  args=(resource_type, server, changed_since,
+                                        batch_size, batches, errors, stop),
+                                  daemon=True)
+                 for resource_type in resource_types]
+    for producer in producers:
+        producer.start()
+    row_count = 0
+    running = len(producers)
+    try:
+        writer = writer_class(path)
+        try:
+            while running:
+                batch = batches.get()
+                if batch is None:
+                    running -= 1
+                    continue
+                writer.write(batch)
+                row_count += len(batch)
+        finally:
+            writer.close()
+    finally:
+        # if writing failed the producers must not stay blocked on the full
+        # queue (and keep the session busy), stop them
+        stop.set()
+        for producer in producers:
+            producer.join()
+        if sign_out is True and (errors or running):
+            # sign out from server
+            server.auth.sign_out()
+    if errors:
+        raise errors[0]
+    state = _load_state(state_path)
+    state[site_key] = started_at
+    _save_state(state_path, state)
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    return (row_count)
+
+
+# number of durations kept per resource in the refresh history
+REFRESH_HISTORY_SIZE = 20
+
+
+def _refresh_key(resource_type, resource_name, project_name):
+    return ("{}/{}/{}".format(resource_type, project_name, resource_name))
+
+
+def _start_refresh(resource_type, resource_name, project_name, server):
+    """
+    Start the refresh of a workbook or datasource and return the job
+    """
+
+    resource_id, resource_object = get_resource_id(resource_type,
+                                                   resource_name,
+                                                   project_name, server)
+    if resource_type == "workbook":
+        return (server.workbooks.refresh(resource_id))
+    elif resource_type == "datasource":
+        return (server.datasources.refresh(resource_object))
+    raise NameError("Invalid resource_type")
+
+
+def wait_for_job(job_id, server, poll_interval=10, timeout=None):
+    """
+    Wait until a job on the server finished
+
+    Parameters:
+    job_id          -- ID of the job
+    server          -- the server object
+    poll_interval   -- seconds between two status requests
+    timeout         -- seconds to wait at most, None to wait forever
+
+    Return value(s):
+    job             -- the finished job object
+
+    Exception(s):
+    TimeoutError    -- the job didn't finish within timeout
+    """
+
+    started = time.time()
+    while True:
+        job = server.jobs.get_by_id(job_id)
+        if job.completed_at is not None:
+            return (job)
+        if timeout is not None and time.time() - started > timeout:
+            raise TimeoutError("Job '{}' didn't finish".format(job_id))
+        time.sleep(poll_interval)
+
+
+def record_refresh_duration(resource_type, resource_name, project_name,
+                            job, history_path=None):
+    """
+    Store the duration of a finished refresh job in the local history
+
+    Parameters:
+    resource_type   -- workbook or datasource
+    resource_name   -- name of the refreshed resource
+    project_name    -- name of the project the resource is stored in
+    job             -- the finished job object
+    history_path    -- path of the refresh history
+                       default: ~/.tableau_wrapper/refresh_history.json
+
+    Return value(s):
+    duration        -- duration of the job in seconds, None if the job
+                       failed (failed jobs don't get recorded)
+    """
+
+    if job.started_at is None or str(job.finish_code) != "0":
+        return (None)
+    if history_path is None:
+        history_path = os.path.join(STATE_DIR, "refresh_history.json")
+    duration = (job.completed_at - job.started_at).total_seconds()
+    history = _load_state(history_path)
+    key = _refresh_key(resource_type, resource_name, project_name)
+    durations = history.get(key, []) + [duration]
+    history[key] = durations[-REFRESH_HISTORY_SIZE:]
+    _save_state(history_path, history)
+    return (duration)
+
+
+def expected_refresh_duration(resource_type, resource_name, project_name,
+                              history, default_duration=600):
+    """
+    Expected duration (median of the recorded ones) of a refresh in seconds,
+    default_duration if there is no history for the resource yet
+    """
+
+    durations = history.get(_refresh_key(resource_type, resource_name,
+                                         project_name))
+    if not durations:
+        return (default_duration)
+    return (statistics.median(durations))
+
+
+def plan_refreshes(resources, deadline, capacity, history_path=None,
+                   default_duration=600, now=None, stagger=60):
+    """
+    Plan staggered starts for the refreshes of resources, so at most
+    capacity refreshes run at the same time and all of them are expected to
+    finish by deadline. The longest refreshes get assigned first, each to
+    the backgrounder slot that frees up first, the first refreshes of the
+    slots start stagger seconds apart and the whole plan starts as late as
+    possible (but not before now).
+
+    Parameters:
+    resources        -- list of (resource_type, resource_name, project_name)
+    deadline         -- datetime all the refreshes should be finished by
+    capacity         -- number of refreshes the backgrounders run at once
+    history_path     -- path of the refresh history
+                        default: ~/.tableau_wrapper/refresh_history.json
+    default_duration -- expected seconds of refreshes without history
+    now              -- datetime the plan can start at the earliest, naive
+                        ones are local time
+                        default: now (in the timezone of deadline)
+    stagger          -- seconds between the first starts of two slots
+
+    Return value(s):
+    plan             -- list of dicts with resource_type, resource_name,
+                        project_name, slot, start, expected_duration and
+                        expected_end, ordered by start
+    makespan         -- expected seconds from the first start to the last end
+    feasible         -- False if the plan is expected to end after deadline
+                        (it starts at now then)
+
+    Exception(s):
+    NameError        -- capacity is smaller than 1
+    """
+
+    if capacity < 1:
+        raise NameError("Invalid capacity '{}', at least one refresh has to "
+                        "run at a time".format(capacity))
+    if history_path is None:
+        history_path = os.path.join(STATE_DIR, "refresh_history.json")
+    if now is None:
+        now = datetime.datetime.now(deadline.tzinfo)
+    elif deadline.tzinfo is not None:
+        # naive datetimes are local time
+        now = now.astimezone(deadline.tzinfo)
+    elif now.tzinfo is not None:
+        now = now.astimezone().replace(tzinfo=None)
+    history = _load_state(history_path)
+    jobs = sorted(((expected_refresh_duration(resource_type, resource_name,
+                                              project_name, history,
+                                              default_duration),
+                    resource_type, resource_name, project_name)
+                   for resource_type, resource_name, project_name
+                   in resources), reverse=True)
+    # offset the slots so their first refreshes don't all start at once
+    slot_free = [float(slot * stagger) for slot in range(capacity)]
+    offsets = []
+    for duration, resource_type, resource_name, project_name in jobs:
+        slot = slot_free.index(min(slot_free))
+        offsets.append((slot_free[slot], slot, duration, resource_type,
+                        resource_name, project_name))
+        slot_free[slot] += duration
+    makespan = max(offset[0] + offset[2] for offset in offsets) \
+        if offsets else 0.0
+    start = max(now, deadline - datetime.timedelta(seconds=makespan))
+    plan = []
+    for offset, slot, duration, resource_type, resource_name, project_name \
+            in sorted(offsets):
+        entry_start = start + datetime.timedelta(seconds=offset)
+        plan.append({"resource_type": resource_type,
+                     "resource_name": resource_name,
+                     "project_name": project_name,
+                     "slot": slot,
+                     "start": entry_start,
+                     "expected_duration": duration,
+                     "expected_end": entry_start + datetime.timedelta(
+                         seconds=duration)})
+    feasible = start + datetime.timedelta(seconds=makespan) <= deadline
+    return (plan, makespan, feasible)
+
+
+def simulate_refresh_plan(plan, history_path=None, capacity=None):
+    """
+    Replay a refresh plan offline against the recorded history: every
+    refresh takes its last recorded duration (the expected one if there is
+    none) and starts at its planned time or when its slot frees up.
+    With capacity the planned slots get ignored and the refreshes run in the
+    order of the plan on capacity slots, as soon as one frees up (like
+    starting all of them at once).
+
+    Parameters:
+    plan            -- plan of plan_refreshes
+    history_path    -- path of the refresh history
+                       default: ~/.tableau_wrapper/refresh_history.json
+    capacity        -- number of slots to run the plan on without the
+                       planned starts, None to follow the plan
+
+    Return value(s):
+    makespan        -- simulated seconds from the first start to the last
+                       end
+    timeline        -- list of (entry, simulated start, simulated end)
+    """
+
+    if history_path is None:
+        history_path = os.path.join(STATE_DIR, "refresh_history.json")
+    history = _load_state(history_path)
+    if not plan:
+        return (0.0, [])
+    origin = min(entry["start"] for entry in plan)
+    slots = {}
+    timeline = []
+    for entry in plan:
+        durations = history.get(_refresh_key(entry["resource_type"],
+                                             entry["resource_name"],
+                                             entry["project_name"]))
+        duration = durations[-1] if durations else entry["expected_duration"]
+        if capacity is None:
+            slot = entry["slot"]
+            planned = (entry["start"] - origin).total_seconds()
+            start = max(planned, slots.get(slot, 0.0))
+        else:
+            free = [slots.get(slot, 0.0) for slot in range(capacity)]
+            slot = free.index(min(free))
+            start = free[slot]
+        slots[slot] = start + duration
+        timeline.append((entry, start, start + duration))
+    return (max(slots.values()), timeline)
+
+
+def run_refresh_plan(plan, history_path=None, poll_interval=10,
+                     server_url=None, username=None, password=None,
+                     server=None):
+    """
+    Run a refresh plan: every slot runs on its own thread, starts its
+    refreshes at their planned time (or once its previous refresh finished)
+    and records the duration of every finished job in the history.
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    plan            -- plan of plan_refreshes
+    history_path    -- path of the refresh history
+                       default: ~/.tableau_wrapper/refresh_history.json
+    poll_interval   -- seconds between two job status requests
+    server_url      -- the url of the server to connect with
+    username        -- username of the user to authenticate with
+    password        -- password of the user to authenticate with
+    server          -- the server object if authenticated previosly
+
+    Return value(s):
+    results         -- list of dicts (one per plan entry) with
+                       resource_type, resource_name, project_name, job_id,
+                       duration and error
+    """
+
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    history_lock = threading.Lock()
+
+    def run_slot(entries):
+        results = []
+        for entry in entries:
+            result = {"resource_type": entry["resource_type"],
+                      "resource_name": entry["resource_name"],
+                      "project_name": entry["project_name"],
+                      "job_id": None, "duration": None, "error": None}
+            delay = (entry["start"] - datetime.datetime.now(
+                entry["start"].tzinfo)).total_seconds()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                job = _start_refresh(entry["resource_type"],
+                                     entry["resource_name"],
+                                     entry["project_name"], server)
+                result["job_id"] = job.id
+                job = wait_for_job(job.id, server, poll_interval)
+                with history_lock:
+                    result["duration"] = record_refresh_duration(
+                        entry["resource_type"], entry["resource_name"],
+                        entry["project_name"], job, history_path)
+                if result["duration"] is None:
+                    result["error"] = "finish code {}".format(job.finish_code)
+            except Exception as err:
+                result["error"] = str(err)
+            results.append(result)
+        return (results)
+
+    slots = {}
+    for entry in plan:
+        slots.setdefault(entry["slot"], []).append(entry)
+    with concurrent.futures.ThreadPoolExecutor(max(len(slots), 1)) as executor:
+        slot_results = list(executor.map(run_slot, slots.values()))
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    by_entry = {}
+    for entries, results in zip(slots.values(), slot_results):
+        for entry, result in zip(entries, results):
+            by_entry[id(entry)] = result
+    return ([by_entry[id(entry)] for entry in plan])
+
+
+def _project_paths(projects):
+    """
+    Map the ids of projects to their paths ('Parent/Child')
+    """
+
+    by_id = {project.id: project for project in projects}
+    paths = {}
+
+    def path(project_id):
+        if project_id not in paths:
+            project = by_id[project_id]
+            if project.parent_id in by_id:
+                paths[project_id] = path(project.parent_id) + "/" + \
+                    project.name
+            else:
+                paths[project_id] = project.name
+        return (paths[project_id])
+    for project_id in by_id:
+        path(project_id)
+    return (paths)
+
+
+def load_site_metadata(server, resource_types=("project", "workbook",
+                                               "datasource")):
+    """
+    Load the metadata of all the resources on the site, the resource types
+    get paged through concurrently
+
+    Parameters:
+    server          -- the server object
+    resource_types  -- 'project'/'workbook'/'datasource' to load
+
+    Return value(s):
+    metadata        -- dict (resource_type, project_path, name) -> dict with
+                       resource_type, project_path, name, id, project_id
+                       and updated_at; project_path of a project is the
+                       path of its parent ('' at the top level)
+
+    Exception(s):
+    NameError       -- invalid resource_type
+    """
+
+    for resource_type in resource_types:
+        if resource_type not in ("project", "workbook", "datasource"):
+            raise NameError("Invalid resource_type '{}'".format(
+                resource_type))
+    # projects are always needed to get the project paths
+    listed_types = ("project",) + tuple(resource_type for resource_type
+                                        in resource_types
+                                        if resource_type != "project")
+    with concurrent.futures.ThreadPoolExecutor(len(listed_types)) as executor:
+        listings = dict(zip(listed_types, executor.map(
+            lambda resource_type: list(get_all_resources(resource_type,
+                                                         server)),
+            listed_types)))
+    paths = _project_paths(listings["project"])
+    metadata = {}
+    for resource_type in resource_types:
+        for item in listings[resource_type]:
+            if resource_type == "project":
+                project_id = item.parent_id
+            else:
+                project_id = item.project_id
+            record = {"resource_type": resource_type,
+                      "project_path": paths.get(project_id, ""),
+                      "name": item.name,
+                      "id": item.id,
+                      "project_id": project_id,
+                      "updated_at": getattr(item, "updated_at", None)}
+            metadata[(resource_type, record["project_path"],
+                      item.name)] = record
+    return (metadata)
+
+
+def _download_to(resource_type, resource_id, directory, server,
+                 include_extract=True):
+    """
+    Download a workbook or datasource by id into directory
+    """
+
+    if resource_type == "workbook":
+        return (server.workbooks.download(resource_id, filepath=directory,
+                                          no_extract=not include_extract))
+    elif resource_type == "datasource":
+        return (server.datasources.download(resource_id, filepath=directory,
+                                            include_extract=include_extract))
+    raise NameError("Invalid resource_type")
+
+
+# elements and attributes of .twb/.tds documents that differ between sites
+# (where the content is stored, which server wrote it) without the content
+# being different
+_SITE_SPECIFIC_ELEMENTS = ("repository-location",)
+_SITE_SPECIFIC_ATTRIBUTES = ("source-build", "source-platform")
+# attributes of connections to published datasources (class 'sqlproxy')
+_SITE_SPECIFIC_CONNECTION_ATTRIBUTES = ("server", "dbname", "port",
+                                        "channel", "server-ds-friendly-name")
+
+
+def _normalized_document(content):
+    """
+    Serialize a .twb/.tds document without its site-specific parts, with
+    sorted attributes and without insignificant whitespace
+    """
+
+    root = ET.fromstring(content)
+    for parent in root.iter():
+        for child in list(parent):
+            if child.tag in _SITE_SPECIFIC_ELEMENTS:
+                parent.remove(child)
+    parts = []
+    for element in root.iter():
+        attributes = dict(element.attrib)
+        for name in _SITE_SPECIFIC_ATTRIBUTES:
+            attributes.pop(name, None)
+        if element.tag == "connection" and \
+                attributes.get("class") == "sqlproxy":
+            for name in _SITE_SPECIFIC_CONNECTION_ATTRIBUTES:
+                attributes.pop(name, None)
+        parts.append(repr((element.tag, sorted(attributes.items()),
+                           (element.text or "").strip(),
+                           (element.tail or "").strip())))
+    return ("\n".join(parts).encode("utf-8"))
+
+
+def _content_hash(resource_type, resource_id, server):
+    """
+    sha256 of the downloaded workbook or datasource (without extract).
+    Only the normalized .twb/.tds document and the contents of the other
+    packaged files get hashed, not the zip metadata (timestamps) or the
+    site-specific parts of the document.
+    """
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = _download_to(resource_type, resource_id, tmp_dir, server,
+                                 include_extract=False)
+        digest = hashlib.sha256()
+        if not zipfile.is_zipfile(file_path):
+            with open(file_path, "rb") as content_file:
+                digest.update(_normalized_document(content_file.read()))
+            return (digest.hexdigest())
+        with zipfile.ZipFile(file_path) as package:
+            for name in sorted(package.namelist()):
+                if name.endswith("/"):
+                    continue
+                content = package.read(name)
+                if os.path.splitext(name)[1].lower() in (".twb", ".tds"):
+                    # the document's name differs with the resource's name
+                    name = "document"
+                    content = _normalized_document(content)
+                digest.update(name.encode("utf-8") + b"\0")
+                digest.update(hashlib.sha256(content).digest())
+        return (digest.hexdigest())
+
+
+# keep the prefix of the user attributes when rewriting documents
+ET.register_namespace("user", "http://www.tableausoftware.com/xml/user")
+
+
+def _site_url(server):
+    """
+    Get the content url of the site the server object is signed in to ('' for
+    the default site)
+    """
+
+    # newer TSC releases keep it from the sign-in, querying the site needs
+    # admin rights
+    site_url = getattr(server, "site_url", None)
+    if site_url is None:
+        site_url = server.sites.get_by_id(server.site_id).content_url
+    return (site_url or "")
+
+
+def _datasource_urls(server):
+    """
+    Map the (project path, name) of every datasource to its content url
+    """
+
+    projects = _project_paths(get_all_resources("project", server))
+    return ({(projects.get(item.project_id, ""), item.name): item.content_url
+             for item in get_all_resources("datasource", server)})
+
+
+def _promotion_target(source_server, target_server):
+    """
+    Collect what _retarget_document needs to point a document of the source
+    to the target: address and site of the target and the content urls of
+    the target datasources by the content urls of the source ones
+    """
+
+    address = urllib.parse.urlparse(target_server.server_address)
+    target_urls = _datasource_urls(target_server)
+    return ({"server": address.hostname,
+             "channel": address.scheme,
+             "port": str(address.port or
+                         (443 if address.scheme == "https" else 80)),
+             "site": _site_url(target_server),
+             "datasources": {url: target_urls[key] for key, url
+                             in _datasource_urls(source_server).items()
+                             if key in target_urls}})
+
+
+def _retarget_document(content, target):
+    """
+    Point the connections to published datasources (class 'sqlproxy') and
+    the repository locations of a .twb/.tds document to the target of
+    _promotion_target
+
+    Exception(s):
+    NameError       -- a published datasource is missing on the target
+    """
+
+    parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True))
+    root = ET.fromstring(content, parser=parser)
+    for element in root.iter():
+        if element.tag == "connection" and \
+                element.get("class") == "sqlproxy":
+            dbname = element.get("dbname")
+            if dbname not in target["datasources"]:
+                raise NameError("Published datasource '{}' is missing on the "
+                                "target".format(dbname))
+            element.set("dbname", target["datasources"][dbname])
+            for name in ("server", "port", "channel"):
+                element.set(name, target[name])
+        elif element.tag == "repository-location":
+            path = element.get("path", "")
+            if element.get("id") in target["datasources"] and \
+                    path.endswith("/datasources"):
+                element.set("id", target["datasources"][element.get("id")])
+            # '/t/<site>/datasources' on other sites than the default one
+            if path.startswith("/t/"):
+                path = "/" + path.split("/", 3)[3] if path.count("/") > 2 \
+                    else ""
+            if target["site"]:
+                element.set("site", target["site"])
+                path = "/t/" + target["site"] + path
+            else:
+                element.attrib.pop("site", None)
+            if "path" in element.attrib:
+                element.set("path", path)
+            if "derived-from" in element.attrib:
+                element.set("derived-from", "{}://{}{}/{}?rev={}".format(
+                    target["channel"], target["server"], path,
+                    element.get("id"), element.get("revision", "1.0")))
+    return (ET.tostring(root, encoding="utf-8", xml_declaration=True))
+
+
+def _retarget_file(file_path, target):
+    """
+    Rewrite the .twb/.tds document of a downloaded workbook or datasource
+    (packaged or not) in place with _retarget_document
+    """
+
+    if not zipfile.is_zipfile(file_path):
+        with open(file_path, "rb") as document_file:
+            content = _retarget_document(document_file.read(), target)
+        with open(file_path, "wb") as document_file:
+            document_file.write(content)
+        return
+    tmp_path = file_path + ".tmp"
+    with zipfile.ZipFile(file_path) as package, \
+            zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as rewritten:
+        for info in package.infolist():
+            content = package.read(info)
+            if os.path.splitext(info.filename)[1].lower() in (".twb", ".tds"):
+                content = _retarget_document(content, target)
+            rewritten.writestr(info, content)
+    os.replace(tmp_path, file_path)
+
+
+def diff_sites(source_server, target_server,
+               resource_types=("project", "workbook", "datasource"),
+               compare="updated_at", max_workers=8):
+    """
+    Compare the resources on two sites (e.g. dev and prod), matched by
+    resource type, project path and name. The metadata of both sites gets
+    loaded concurrently with full pagination.
+
+    Parameters:
+    source_server   -- the server object of the site to promote from
+    target_server   -- the server object of the site to promote to
+    resource_types  -- 'project'/'workbook'/'datasource' to compare
+    compare         -- how to detect changed workbooks and datasources
+                       'updated_at': updated later on the source than on
+                       the target
+                       'content': different content hash of the normalized
+                       .twb/.tds and packaged files (downloads both sides
+                       without extract, on max_workers threads)
+    max_workers     -- maximum number of concurrent downloads for 'content'
+
+    Return value(s):
+    diff            -- dict with the lists 'added' (only on the source),
+                       'changed' and 'removed' (only on the target) of
+                       metadata records, changed ones with the 'target_id'
+
+    Exception(s):
+    NameError       -- invalid resource_type or compare
+    """
+
+    if compare not in ("updated_at", "content"):
+        raise NameError("Invalid compare '{}'".format(compare))
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        source, target = executor.map(
+            lambda server: load_site_metadata(server, resource_types),
+            (source_server, target_server))
+    added = [record for key, record in source.items() if key not in target]
+    removed = [record for key, record in target.items() if key not in source]
+    both = [(record, target[key]) for key, record in source.items()
+            if key in target and record["resource_type"] != "project"]
+    if compare == "updated_at":
+        changed = [(record, other) for record, other in both
+                   if record["updated_at"] is not None and
+                   (other["updated_at"] is None or
+                    record["updated_at"] > other["updated_at"])]
+    else:
+        def hashes(pair):
+            record, other = pair
+            return (_content_hash(record["resource_type"], record["id"],
+                                  source_server) !=
+                    _content_hash(other["resource_type"], other["id"],
+                                  target_server))
+        results = run_parallel(hashes, both, max_workers=max_workers)
+        for _, _, _, error in results:
+            if error is not None:
+                raise error
+        changed = [pair for pair, _, differs, _ in results if differs]
+    changed = [dict(record, target_id=other["id"])
+               for record, other in changed]
+    return ({"added": added, "changed": changed, "removed": removed})
+
+
+def promotion_plan(diff, include_removed=False):
+    """
+    Turn a diff of diff_sites into the ordered steps promoting the source to
+    the target: create the added projects (parents first), publish the added
+    and changed datasources, then workbooks, and optionally delete the
+    removed resources (contents before projects, children before parents).
+
+    Parameters:
+    diff            -- diff of diff_sites
+    include_removed -- also delete the resources only on the target
+
+    Return value(s):
+    plan            -- list of dicts with action ('create'/'publish'/
+                       'delete') and the metadata record
+    """
+
+    def depth(record):
+        return (record["project_path"].count("/") +
+                bool(record["project_path"]))
+    plan = []
+    for record in sorted((record for record in diff["added"]
+                          if record["resource_type"] == "project"),
+                         key=depth):
+        plan.append({"action": "create", "record": record})
+    for resource_type in ("datasource", "workbook"):
+        for record in diff["added"] + diff["changed"]:
+            if record["resource_type"] == resource_type:
+                plan.append({"action": "publish", "record": record})
+    if include_removed:
+        removed = sorted(diff["removed"], key=lambda record: (
+            record["resource_type"] == "project", -depth(record)))
+        for record in removed:
+            plan.append({"action": "delete", "record": record})
+    return (plan)
+
+
+def execute_promotion_plan(plan, source_server, target_server,
+                           max_workers=8, retries=2):
+    """
+    Execute a promotion plan of promotion_plan. Projects get created in
+    order, the publishes run as a parallel download/publish pipeline on
+    max_workers threads (datasources before workbooks), deletes run last.
+    Published workbooks and datasources overwrite the ones on the target,
+    embedded connection credentials are not promoted. Connections to
+    published datasources get pointed to the ones on the target (a
+    workbook using a datasource missing on the target fails).
+
+    Parameters:
+    plan            -- plan of promotion_plan
+    source_server   -- the server object of the site to promote from
+    target_server   -- the server object of the site to promote to
+    max_workers     -- maximum number of concurrent steps
+    retries         -- number of retries per step if it fails
+
+    Return value(s):
+    plan            -- the plan with status ('done'/'failed'), attempts and
+                       error filled in for every step
+    """
+
+    target_projects = list(get_all_resources("project", target_server))
+    project_ids = {path: project_id for project_id, path
+                   in _project_paths(target_projects).items()}
+
+    def parent_id(record):
+        # a missing parent (e.g. its create failed) must not turn the
+        # project or resource into a top-level one
+        if record["project_path"] not in project_ids:
+            raise NameError("Parent project '{}' is missing on the "
+                            "target".format(record["project_path"]))
+        return (project_ids[record["project_path"]])
+
+    def create(step):
+        record = step["record"]
+        project = TSC.ProjectItem(
+            record["name"],
+            parent_id=parent_id(record) if record["project_path"] else None)
+        project = target_server.projects.create(project)
+        path = "/".join(filter(None, (record["project_path"],
+                                      record["name"])))
+        project_ids[path] = project.id
+
+    def publish_step(step):
+        record = step["record"]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_path = _download_to(record["resource_type"], record["id"],
+                                     tmp_dir, source_server)
+            # the document still points to the datasources of the source
+            _retarget_file(file_path, target)
+            project_id = parent_id(record)
+            if record["resource_type"] == "workbook":
+                item = TSC.WorkbookItem(project_id, name=record["name"])
+                target_server.workbooks.publish(item, file_path, "Overwrite")
+            else:
+                item = TSC.DatasourceItem(project_id, name=record["name"])
+                target_server.datasources.publish(item, file_path,
+                                                  "Overwrite")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def delete_step(step):
+        record = step["record"]
+        _get_endpoint(record["resource_type"],
+                      target_server).delete(record["id"])
+
+    def record_results(results):
+        for step, attempts, _, error in results:
+            step["attempts"] = attempts
+            step["status"] = "failed" if error else "done"
+            step["error"] = str(error) if error else None
+
+    # projects one by one, children need the ids of their parents
+    record_results(run_parallel(
+        create, [step for step in plan if step["action"] == "create"],
+        max_workers=1, retries=retries))
+    for resource_type in ("datasource", "workbook"):
+        # once the datasources are published, to point the workbooks at them
+        target = _promotion_target(source_server, target_server)
+        record_results(run_parallel(
+            publish_step,
+            [step for step in plan if step["action"] == "publish" and
+             step["record"]["resource_type"] == resource_type],
+            max_workers=max_workers, retries=retries))
+    record_results(run_parallel(
+        delete_step, [step for step in plan if step["action"] == "delete"],
+        max_workers=1, retries=retries))
+    return (plan)
+
+
+class ProjectTree(object):
+    """
+    Projects of a site with their parent/child links, indexed by id
+    """
+
+    def __init__(self, projects):
+        self.projects = {project.id: project for project in projects}
+        self.children = {project_id: [] for project_id in self.projects}
+        self.roots = []
+        for project in self.projects.values():
+            if project.parent_id in self.projects:
+                self.children[project.parent_id].append(project.id)
+            else:
+                self.roots.append(project.id)
+        self.paths = _project_paths(self.projects.values())
+        self.ids = {path: project_id
+                    for project_id, path in self.paths.items()}
+
+    def find(self, project_path):
+        """
+        Get the id of the project with the path 'Parent/Child'
+
+        Exception(s):
+        NameError       -- invalid project_path
+        """
+
+        if project_path not in self.ids:
+            raise NameError("Invalid project_path '{}'".format(project_path))
+        return (self.ids[project_path])
+
+    def subtree(self, project_id):
+        """
+        Get the ids of the project and all its descendants, parents before
+        their children
+        """
+
+        ids = [project_id]
+        for current in ids:
+            ids.extend(self.children[current])
+        return (ids)
+
+    def depth(self, project_id):
+        return (self.paths[project_id].count("/"))
+
+
+def load_project_tree(server):
+    """
+    Load all the projects of the site (one paginated listing) as a tree
+
+    Parameters:
+    server          -- the server object
+
+    Return value(s):
+    tree            -- ProjectTree
+    """
+
+    return (ProjectTree(get_all_resources("project", server)))
+
+
+def _subtree_contents(tree, project_ids, server,
+                      resource_types=("workbook", "datasource")):
+    """
+    Get the workbooks and datasources stored in the projects project_ids,
+    with one paginated listing per resource type
+    """
+
+    project_ids = set(project_ids)
+    with concurrent.futures.ThreadPoolExecutor(len(resource_types)) as \
+            executor:
+        listings = executor.map(
+            lambda resource_type: [
+                (resource_type, item)
+                for item in get_all_resources(resource_type, server)
+                if item.project_id in project_ids],
+            resource_types)
+        return ([content for listing in listings for content in listing])
+
+
+def _project_entry(tree, resource_type, item, action):
+    entry = _plan_entry(resource_type, item, action)
+    if resource_type == "project":
+        entry["project_name"] = tree.paths[item.id]
+    else:
+        entry["project_name"] = tree.paths[item.project_id]
+    return (entry)
+
+
+def download_project(project_path, path=None, include_extract=True,
+                     max_workers=8, retries=2, server_url=None,
+                     username=None, password=None, server=None):
+    """
+    Download all the workbooks and datasources of a project and all its
+    sub-projects into a directory tree mirroring the projects, on a bounded
+    worker pool.
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    project_path    -- path of the project ('Parent/Child')
+    path            -- directory to download to (default: cwd)
+    include_extract -- boolean if extracts should be included
+    max_workers     -- maximum number of concurrent downloads
+    retries         -- number of retries per resource if the download fails
+    server_url      -- the url of the server to connect with
+    username        -- username of the user to authenticate with
+    password        -- password of the user to authenticate with
+    server          -- the server object if authenticated previosly
+
+    Return value(s):
+    results         -- list of dicts (one per resource) with id, name,
+                       project_name (project path), action, status
+                       ('done'/'failed'), attempts and error
+
+    Exception(s):
+    NameError       -- invalid project_path
+    """
+
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    if path is None:
+        path = os.getcwd()
+    tree = load_project_tree(server)
+    project_ids = tree.subtree(tree.find(project_path))
+    # the directory of the project itself is named after it
+    prefix = project_path.rsplit("/", 1)[0] + "/" if "/" in project_path \
+        else ""
+    for project_id in project_ids:
+        os.makedirs(os.path.join(path, tree.paths[project_id][len(prefix):]),
+                    exist_ok=True)
+    contents = _subtree_contents(tree, project_ids, server)
+    plan = [_project_entry(tree, resource_type, item, "download")
+            for resource_type, item in contents]
+
+    def act(item, entry):
+        directory = os.path.join(path, entry["project_name"][len(prefix):])
+        return (_download_to(entry["resource_type"], item.id, directory,
+                             server, include_extract))
+    _execute_plan(plan, [item for _, item in contents], act, max_workers,
+                  retries)
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    return (plan)
+
+
+def _project_delete_plan(tree, project_ids, server):
+    """
+    Plan deleting the projects project_ids with their workbooks and
+    datasources: the contents first, then the projects deepest first
+    """
+
+    contents = _subtree_contents(tree, project_ids, server)
+    content_plan = [_project_entry(tree, resource_type, item, "delete")
+                    for resource_type, item in contents]
+    # deepest projects first, siblings are independent of each other
+    levels = {}
+    for project_id in project_ids:
+        levels.setdefault(tree.depth(project_id), []).append(
+            tree.projects[project_id])
+    return (content_plan + [_project_entry(tree, "project", project, "delete")
+                            for _, projects in sorted(levels.items(),
+                                                      reverse=True)
+                            for project in projects])
+
+
+def delete_project(project_path, dry_run=True, max_workers=8, retries=2,
+                   server_url=None, username=None, password=None,
+                   server=None):
+    """
+    Delete a project with all its sub-projects, workbooks and datasources.
+    The workbooks and datasources get deleted first, then the projects
+    from the deepest level up, each level on a bounded worker pool.
+    With dry_run (default) nothing gets deleted, only the plan is returned,
+    pass it to execute_project_delete_plan to delete exactly what it lists.
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    project_path    -- path of the project ('Parent/Child')
+    dry_run         -- only plan, don't delete (default True)
+    max_workers     -- maximum number of concurrent deletes
+    retries         -- number of retries per resource if the delete fails
+    server_url      -- the url of the server to connect with
+    username        -- username of the user to authenticate with
+    password        -- password of the user to authenticate with
+    server          -- the server object if authenticated previosly
+
+    Return value(s):
+    plan            -- list of dicts (one per resource) with id, name,
+                       project_name (project path), action, status
+                       ('planned'/'done'/'failed'), attempts and error
+
+    Exception(s):
+    NameError       -- invalid project_path
+    """
+
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    tree = load_project_tree(server)
+    plan = _project_delete_plan(tree, tree.subtree(tree.find(project_path)),
+                                server)
+    if not dry_run:
+        execute_project_delete_plan(plan, max_workers, retries,
+                                    server=server)
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    return (plan)
+
+
+def execute_project_delete_plan(plan, max_workers=8, retries=2,
+                                server_url=None, username=None,
+                                password=None, server=None):
+    """
+    Execute a plan of delete_project (e.g. after the user confirmed the dry
+    run): the workbooks and datasources first, then the projects from the
+    deepest level up, each level on a bounded worker pool. Only the
+    resources listed in the plan get deleted, nothing gets listed again.
+    A project still holding a resource that failed to delete (directly or
+    in a sub-project) gets skipped, deleting it would delete that resource
+    as well.
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    plan            -- plan of delete_project
+    max_workers     -- maximum number of concurrent deletes
+    retries         -- number of retries per resource if the delete fails
+                       with a transient error
+    server_url      -- the url of the server to connect with
+    username        -- username of the user to authenticate with
+    password        -- password of the user to authenticate with
+    server          -- the server object if authenticated previosly
+
+    Return value(s):
+    plan            -- the plan with status ('done'/'failed'/'skipped'),
+                       attempts and error filled in for every resource
+    """
+
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    # paths of the projects still holding a resource that didn't get deleted
+    blocked = set()
+
+    def block(project_path):
+        parts = project_path.split("/")
+        blocked.update("/".join(parts[:depth])
+                       for depth in range(1, len(parts) + 1))
+    for entry in _run_bulk_entries([entry for entry in plan
+                                    if entry["resource_type"] != "project"],
+                                   max_workers, retries, server):
+        if entry["status"] == "failed":
+            block(entry["project_name"])
+    # the project path of a project entry is its own path
+    levels = {}
+    for entry in plan:
+        if entry["resource_type"] == "project":
+            levels.setdefault(entry["project_name"].count("/"),
+                              []).append(entry)
+    for _, entries in sorted(levels.items(), reverse=True):
+        for entry in entries:
+            if entry["project_name"] in blocked:
+                entry["status"] = "skipped"
+                entry["error"] = "contains resources that didn't get deleted"
+        for entry in _run_bulk_entries([entry for entry in entries
+                                        if entry["status"] != "skipped"],
+                                       max_workers, retries, server):
+            if entry["status"] == "failed":
+                block(entry["project_name"])
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    return (plan)
+
+
+def _get_grantee(grantee_type, grantee_name, server):
+    """
+    Get a reference to the user or group grantee_name for permission rules
+    """
+
+    options = TSC.RequestOptions()
+    options.filter.add(TSC.Filter(TSC.RequestOptions.Field.Name,
+                                  TSC.RequestOptions.Operator.Equals,
+                                  grantee_name))
+    if grantee_type == "user":
+        result, _ = server.users.get(req_options=options)
+        item_class = TSC.UserItem
+    elif grantee_type == "group":
+        result, _ = server.groups.get(req_options=options)
+        item_class = TSC.GroupItem
+    else:
+        raise NameError("Invalid grantee_type '{}'".format(grantee_type))
+    if not result:
+        raise NameError("No {} with the name '{}' on the server".format(
+            grantee_type, grantee_name))
+    return (item_class.as_reference(result[0].id))
+
+
+def set_project_permissions(project_path, grantee_type, grantee_name,
+                            capabilities, include_contents=True,
+                            max_workers=8, retries=2, server_url=None,
+                            username=None, password=None, server=None):
+    """
+    Grant or deny capabilities to a user or group on a project, all its
+    sub-projects and (optionally) their workbooks and datasources, on a
+    bounded worker pool. Capabilities of the grantee that aren't given stay
+    untouched.
+    Authetication happens by either passing the credentials (username, pass-
+    word and server_url) or the server object when previosly authenticated.
+
+    Parameters:
+    project_path     -- path of the project ('Parent/Child')
+    grantee_type     -- 'user'/'group'
+    grantee_name     -- name of the user or group
+    capabilities     -- dict capability -> 'Allow'/'Deny'
+                        e.g. {'Read': 'Allow', 'Write': 'Deny'}
+    include_contents -- also set the permissions on the workbooks and
+                        datasources in the projects
+    max_workers      -- maximum number of concurrent updates
+    retries          -- number of retries per resource if the update fails
+    server_url       -- the url of the server to connect with
+    username         -- username of the user to authenticate with
+    password         -- password of the user to authenticate with
+    server           -- the server object if authenticated previosly
+
+    Return value(s):
+    results          -- list of dicts (one per resource) with id, name,
+                        project_name (project path), action, status
+                        ('done'/'failed'), attempts and error
+
+    Exception(s):
+    NameError        -- invalid project_path, grantee_type or grantee_name
+    """
+
+    # check if the either all the necessary credentials or the server object
+    # are there and authenticate if necessary
+    server, sign_out = check_credentials_authenticate(username, password,
+                                                      server_url, server)
+    grantee = _get_grantee(grantee_type, grantee_name, server)
+    tree = load_project_tree(server)
+    project_ids = tree.subtree(tree.find(project_path))
+    items = [("project", tree.projects[project_id])
+             for project_id in project_ids]
+    if include_contents:
+        items += _subtree_contents(tree, project_ids, server)
+    plan = [_project_entry(tree, resource_type, item, "permissions")
+            for resource_type, item in items]
+
+    def act(item, entry):
+        rule = TSC.PermissionsRule(grantee, dict(capabilities))
+        return (_get_endpoint(entry["resource_type"],
+                              server).update_permissions(item, [rule]))
+    _execute_plan(plan, [item for _, item in items], act, max_workers,
+                  retries)
+    if sign_out is True:
+        # sign out from server
+        server.auth.sign_out()
+    return (plan)
+
+
+# namespace of the elements in the responses of the REST API
+_API_NAMESPACE = "{http://tableau.com/api}"
+
+
+class ResourceRecord(object):
+    """
+    Compact record of a listed resource with only the fields needed to pick
+    and act on it (project_id of a project is the id of its parent)
+    """
+
+    __slots__ = ("resource_type", "id", "name", "project_id", "project_name",
+                 "owner_id", "updated_at", "size")
+
+    def __init__(self, resource_type, id, name, project_id=None,
+                 project_name=None, owner_id=None, updated_at=None,
+                 size=None):
+        self.resource_type = resource_type
+        self.id = id
+        self.name = name
+        self.project_id = project_id
+        self.project_name = project_name
+        self.owner_id = owner_id
+        self.updated_at = updated_at
+        self.size = size
+
+    def __repr__(self):
+        return ("ResourceRecord({!r}, {!r}, {!r})".format(
+            self.resource_type, self.id, self.name))
+
+
+def _parse_datetime(value):
+    """
+    Parse a timestamp of the REST API into a datetime in UTC, like the ones
+    of the TSC items
+    """
+
+    if value is None:
+        return (None)
+    return (datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+            .replace(tzinfo=datetime.timezone.utc))
+
+
+def _response_error(response):
+    """
+    Build the ServerResponseError of a failed REST API response, out of its
+    error element or the HTTP status if the body isn't one
+    """
+
+    code, summary, detail = (str(response.status_code), response.reason,
+                             response.text)
+    try:
+        error = ET.fromstring(response.content).find(_API_NAMESPACE + "error")
+    except ET.ParseError:
+        error = None
+    if error is not None:
+        code = error.get("code", code)
+        summary = error.findtext(_API_NAMESPACE + "summary", summary)
+        detail = error.findtext(_API_NAMESPACE + "detail", detail)
+    return (TSC.ServerResponseError(code, summary, detail))
+
+
+def _parse_records(resource_type, content):
+    """
+    Parse the records and the total number of resources out of a listing
+    response, without building the full TSC items
+
+    Return value(s):
+    records         -- list of ResourceRecord
+    total           -- number of resources on the server
+    """
+
+    item_tag = _API_NAMESPACE + resource_type
+    project_tag = _API_NAMESPACE + "project"
+    owner_tag = _API_NAMESPACE + "owner"
+    records = []
+    total = 0
+    parent = None
+    for event, element in ET.iterparse(io.BytesIO(content),
+                                       events=("start", "end")):
+        if event == "start":
+            # remember the list element to drop the parsed items from it
+            if element.tag == item_tag + "s":
+                parent = element
+            continue
+        if element.tag == item_tag:
+            record = ResourceRecord(resource_type, element.get("id"),
+                                    element.get("name"),
+                                    updated_at=_parse_datetime(
+                                        element.get("updatedAt")))
+            size = element.get("size")
+            if size is not None:
+                record.size = int(size)
+            if resource_type == "project":
+                record.project_id = element.get("parentProjectId")
+            else:
+                project = element.find(project_tag)
+                if project is not None:
+                    record.project_id = project.get("id")
+                    record.project_name = project.get("name")
+            owner = element.find(owner_tag)
+            if owner is not None:
+                record.owner_id = owner.get("id")
+            records.append(record)
+            if parent is not None:
+                parent.remove(element)
+        elif element.tag == _API_NAMESPACE + "pagination":
+            total = int(element.get("totalAvailable"))
+    return (records, total)
+
+
+def iter_resource_pages(resource_type, server, page_size=1000):
+    """
+    Page through all the resources of type resource_type on the server and
+    yield every page as a list of compact ResourceRecord objects instead of
+    TSC items
+
+    Parameters:
+    resource_type   -- type of the resources
+                       'workbook'/'view'/'datasource'/'project'
+    server          -- the server object
+    page_size       -- number of resources requested per call
+
+    Return value(s):
+    pages           -- generator of lists of ResourceRecord
+
+    Exception(s):
+    NameError           -- invalid resource_type
+    ServerResponseError -- the server refused a listing request
+    """
+
+    endpoint = _get_endpoint(resource_type, server)
+    # reuse the session of the server object if it has one
+    session = getattr(server, "session", None)
+    if session is None:
+        session = requests
+    # same verify/cert/timeout options as the requests of the TSC endpoints
+    http_options = getattr(server, "http_options", None) or {}
+    page_number = 1
+    while True:
+        response = session.get(endpoint.baseurl,
+                               params={"pageSize": page_size,
+                                       "pageNumber": page_number},
+                               headers={"x-tableau-auth": server.auth_token},
+                               **http_options)
+        if not response.ok:
+            raise _response_error(response)
+        records, total = _parse_records(resource_type, response.content)
+        if records:
+            yield records
+        if not records or page_number * page_size >= total:
+            return
+        page_number += 1
+
+
+def iter_resource_records(resource_type, server, page_size=1000):
+    """
+    Yield all the resources of type resource_type on the server one by one
+    as compact ResourceRecord objects (see iter_resource_pages)
+    """
+
+    for records in iter_resource_pages(resource_type, server, page_size):
+        for record in records:
+            yield record
+
+
+def get_resource_records(resource_type, server, page_size=1000):
+    """
+    Get a list of all the resources of type resource_type on the server as
+    compact ResourceRecord objects (see iter_resource_records)
+    """
+
+    return (list(iter_resource_records(resource_type, server, page_size)))
+
+
+def materialize(record, server):
+    """
+    Get the full TSC item of a ResourceRecord
+
+    Parameters:
+    record          -- ResourceRecord
+    server          -- the server object
+
+    Return value(s):
+    resource        -- the resource as TSC item
+
+    Exception(s):
+    NameError       -- the resource doesn't exist (anymore)
+    """
+
+    if record.resource_type != "project":
+        return (_get_endpoint(record.resource_type,
+                              server).get_by_id(record.id))
+    # projects can't be fetched by id, look it up in the listing
+    for project in get_all_resources("project", server):
+        if project.id == record.id:
+            return (project)
+    raise NameError("Invalid project '{}'".format(record.name))